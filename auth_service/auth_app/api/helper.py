@@ -1,8 +1,6 @@
-import os
 from flask import jsonify
-from auth_app.settings import ProdConfig, StgConfig
-
-CONFIG = ProdConfig if os.environ.get('ENV') == 'prd' else StgConfig
+from auth_app.metrics import metrics
+from auth_app.settings import CONFIG  # noqa: F401
 
 
 def send_result(data: any = None, message: str = "OK", code: int = 200,
@@ -29,7 +27,9 @@ def send_result(data: any = None, message: str = "OK", code: int = 200,
         "message": message_dict,
     }
 
-    return jsonify(res), 200
+    with metrics.timed('serialize'):
+        response = jsonify(res)
+    return response, 200
 
 
 def send_error(data: any = None, message: str = "Error", code: int = 200,
@@ -56,6 +56,8 @@ def send_error(data: any = None, message: str = "Error", code: int = 200,
         "message": message_dict,
     }
 
-    return jsonify(res), code
+    with metrics.timed('serialize'):
+        response = jsonify(res)
+    return response, code
 
 
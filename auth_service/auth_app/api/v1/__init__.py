@@ -1 +1,2 @@
 from auth_app.api.v1 import auth
+from auth_app.api.v1 import stats
@@ -1,14 +1,22 @@
-import json
-import uuid
 from datetime import timedelta
-from flask import Blueprint, request
-from flask_jwt_extended import (create_access_token, create_refresh_token)
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, request, current_app
+from flask_jwt_extended import (create_access_token, create_refresh_token, decode_token, get_jwt_identity,
+                                get_raw_jwt)
+from flask_jwt_extended.exceptions import JWTExtendedException, RevokedTokenError, WrongTokenError
+from flask_jwt_extended.utils import verify_token_claims, verify_token_not_blacklisted, verify_token_type
+from jwt import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy.exc import IntegrityError
 from auth_app.api.helper import send_error, send_result
-from auth_app.utils import logged_input, get_timestamp_now
-from auth_app.validator import SignupBodyValidation, LoginBodyValidation, UserSchema
+from auth_app.utils import logged_input, get_timestamp_now, normalize_email
+from auth_app.validator import (signup_validator, login_validator, logout_validator, revoke_token_validator,
+                                validate_tokens_validator, UserSchema)
 from auth_app.models import User, Token
-from auth_app.extensions import db, jwt
+from auth_app.extensions import db, jwt, key_ring
+from auth_app.ids import new_id
+from auth_app.token_writer import token_writer
+from auth_app.revocation import revocation_store
+from auth_app.hashing import password_hasher, HashingBusy
+from auth_app.metrics import metrics
 from flask_jwt_extended import verify_jwt_in_request
 
 ACCESS_EXPIRES = timedelta(days=1)
@@ -35,35 +43,34 @@ def signup():
         return send_error(message='Request Body incorrect json format: ' + str(ex), code=442)
 
     # Log request api
-    logged_input(json.dumps(json_req))
+    logged_input(json_req)
     if json_req is None:
         return send_error(message='Please check your json requests', code=442)
 
-    # trim input body
-    json_body = {}
-    for key, value in json_req.items():
-        if isinstance(value, str):
-            json_body.setdefault(key, value.strip())
-        else:
-            json_body.setdefault(key, value)
-
-    # validate request body
-    is_not_validate = SignupBodyValidation().validate(json_body)  # Dictionary show detail error fields
+    # trim and validate request body
+    with metrics.timed('validate'):
+        json_body, is_not_validate = signup_validator.validate(json_req)  # Dictionary show detail error fields
     if is_not_validate:
         return send_error(data=is_not_validate, message='Invalid parameters')
 
     email = json_body.get('email')
     password = json_body.get('password')
-    duplicated_user = User.query.filter(User.email == email).first()
-    if duplicated_user:
-        return send_error(message='User existed')
 
     created_date = get_timestamp_now()
-    _id = str(uuid.uuid4())
-    password_hash = generate_password_hash(password)
-    new_user = User(id=_id, email=email, password_hash=password_hash, created_date=created_date)
-    db.session.add(new_user)
-    db.session.commit()
+    _id = new_id()
+    try:
+        password_hash = password_hasher.hash(password)
+    except HashingBusy:
+        return send_error(message='Server is busy, please try again later', code=503)
+    new_user = User(id=_id, email=email, email_key=normalize_email(email), password_hash=password_hash,
+                    created_date=created_date)
+    # unique email_key rejects duplicated users, even when two signups race
+    try:
+        db.session.add(new_user)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return send_error(message='User existed')
 
     data = {
         'user_id': _id
@@ -95,17 +102,13 @@ def login():
     except Exception as ex:
         return send_error(message='Request Body incorrect json format: ' + str(ex), code=442)
 
-    logged_input(json.dumps(json_req))
+    logged_input(json_req)
     if json_req is None:
         return send_error(message='Please check your json requests', code=442)
 
-    # trim input body
-    json_body = {}
-    for key, value in json_req.items():
-        json_body.setdefault(key, str(value).strip())
-
-    # validate request body
-    is_not_validate = LoginBodyValidation().validate(json_body)  # Dictionary show detail error fields
+    # trim and validate request body
+    with metrics.timed('validate'):
+        json_body, is_not_validate = login_validator.validate(json_req)  # Dictionary show detail error fields
     if is_not_validate:
         return send_error(data=is_not_validate, message='Invalid params')
 
@@ -113,18 +116,30 @@ def login():
     email = json_body.get('email')
     password = json_body.get('password')
 
-    user = User.query.filter(User.email == email).first()
-    if user is None or (password and not check_password_hash(user.password_hash, password)):
-        return send_error(message='Login failed')
+    # read from a replica, the primary only has to take the writes
+    credentials = db.replica_or_primary(User.get_credentials, email)
+    try:
+        if credentials is None or (password and not password_hasher.check(credentials.password_hash, password)):
+            return send_error(message='Login failed')
+
+        # upgrade hash made with an older method or cost
+        if password and password_hasher.needs_rehash(credentials.password_hash):
+            User.query.filter(User.id == credentials.id).update({'password_hash': password_hasher.hash(password)},
+                                                               synchronize_session=False)
+            db.session.commit()
+            password_hasher.counters['rehashed'] += 1
+    except HashingBusy:
+        return send_error(message='Server is busy, please try again later', code=503)
 
-    access_token = create_access_token(identity=user.id, expires_delta=ACCESS_EXPIRES)
-    refresh_token = create_refresh_token(identity=user.id, expires_delta=REFRESH_EXPIRES)
+    with metrics.timed('sign'):
+        access_token = create_access_token(identity=credentials.id, expires_delta=ACCESS_EXPIRES)
+        refresh_token = create_refresh_token(identity=credentials.id, expires_delta=REFRESH_EXPIRES)
 
     # Store the tokens in our store with a status of not currently revoked.
-    Token.add_token_to_database(access_token, user.id)
-    Token.add_token_to_database(refresh_token, user.id)
+    token_writer.add_tokens([access_token, refresh_token], credentials.id)
 
-    data: dict = UserSchema().dump(user)
+    # credentials row has the columns of UserSchema, no other query
+    data: dict = UserSchema().dump(credentials)
     data.setdefault('access_token', access_token)
     data.setdefault('refresh_token', refresh_token)
 
@@ -144,3 +159,150 @@ def validate_token():
     """
     verify_jwt_in_request()
     return send_result(message='Token valid')
+
+
+def check_access_token(encoded_token: str) -> dict:
+    """
+    Checks of verify_jwt_in_request on a token that is not in the Authorization header:
+    signature and expiry, token type, revocation and user claims
+    :param encoded_token:
+    :return: claims of token, raise the error verify_jwt_in_request would raise
+    """
+    claims = decode_token(encoded_token)
+    verify_token_type(claims, expected_type='access')
+    verify_token_not_blacklisted(claims, 'access')
+    verify_token_claims(claims)
+    return claims
+
+
+@api.route('/tokens/validate/batch', methods=['POST'])
+def validate_tokens():
+    """
+    Validate many access tokens in one request, e.g. by gateways that check tokens of many users
+
+    Requests Body:
+            tokens: list of string, require, at most TOKEN_VALIDATE_MAX_BATCH, a token that is not a string or
+                    longer than TOKEN_VALIDATE_MAX_LENGTH is invalid
+
+    Returns:
+            {
+                "tokens": result of each token in order of request, {
+                    "status": valid, expired, revoked, wrong_type or invalid
+                    "identity": user id, null if not valid
+                    "expires_in": seconds until token expires, 0 if not valid
+                }
+            }
+    """
+
+    json_body, is_not_validate = validate_tokens_validator.validate(request.get_json(silent=True) or {})
+    if is_not_validate:
+        return send_error(data=is_not_validate, message='Invalid params')
+    tokens = json_body['tokens']
+    if len(tokens) > current_app.config['TOKEN_VALIDATE_MAX_BATCH']:
+        return send_error(message=f'At most {current_app.config["TOKEN_VALIDATE_MAX_BATCH"]} tokens per request')
+
+    identity_claim = current_app.config['JWT_IDENTITY_CLAIM']
+    max_length = current_app.config['TOKEN_VALIDATE_MAX_LENGTH']
+    now = get_timestamp_now()
+    invalid = {'status': 'invalid', 'identity': None, 'expires_in': 0}
+    # not a string or too long: invalid, the other tokens of the batch are still checked
+    tokens = [token if isinstance(token, str) and 0 < len(token) <= max_length else None for token in tokens]
+    results = {None: invalid}  # a token sent more than once is checked once
+    for token in tokens:
+        if token in results:
+            continue
+        try:
+            claims = check_access_token(token)
+            results[token] = {'status': 'valid', 'identity': claims[identity_claim],
+                              'expires_in': max(0, claims['exp'] - now)}
+            continue
+        except ExpiredSignatureError:
+            status = 'expired'
+        except RevokedTokenError:
+            status = 'revoked'
+        except WrongTokenError:
+            status = 'wrong_type'
+        except (InvalidTokenError, JWTExtendedException):
+            status = 'invalid'
+        results[token] = {'status': status, 'identity': None, 'expires_in': 0}
+
+    return send_result(data={'tokens': [results[token] for token in tokens]})
+
+
+@api.route('/logout', methods=['POST'])
+def logout():
+    """
+    Logout API, revoke current access token and refresh token of same user if any
+
+    Requests Header:
+            Authorization: string, require
+    Requests Body:
+            refresh_token: string, optional
+
+    Returns:
+            logged out or not
+    """
+
+    verify_jwt_in_request()
+    json_body, is_not_validate = logout_validator.validate(request.get_json(silent=True) or {})
+    if is_not_validate:
+        return send_error(data=is_not_validate, message='Invalid params')
+
+    tokens = [get_raw_jwt()]
+    refresh_token = json_body.get('refresh_token')
+    if refresh_token:
+        try:
+            refresh_claims = decode_token(refresh_token)
+        except Exception as ex:
+            return send_error(message='Invalid refresh token: ' + str(ex))
+        identity_claim = current_app.config['JWT_IDENTITY_CLAIM']
+        if refresh_claims['type'] != 'refresh' or refresh_claims[identity_claim] != get_jwt_identity():
+            return send_error(message='Invalid refresh token')
+        tokens.append(refresh_claims)
+
+    for token in tokens:
+        revocation_store.revoke(token['jti'], token['exp'])
+    return send_result(message='Logged out successfully!')
+
+
+@api.route('/tokens/revoke', methods=['POST'])
+def revoke_token():
+    """
+    Revoke a token of current user
+
+    Requests Header:
+            Authorization: string, require
+    Requests Body:
+            jti: string, require
+
+    Returns:
+            revoked or not
+    """
+
+    verify_jwt_in_request()
+    json_body, is_not_validate = revoke_token_validator.validate(request.get_json(silent=True) or {})
+    if is_not_validate:
+        return send_error(data=is_not_validate, message='Invalid params')
+
+    jti = json_body.get('jti')
+    token = Token.query.filter(Token.jti == jti, Token.user_identity == get_jwt_identity()).first()
+    if token is None and token_writer.flush():
+        token = Token.query.filter(Token.jti == jti, Token.user_identity == get_jwt_identity()).first()
+    if token is None:
+        return send_error(message='Token not found')
+
+    revocation_store.revoke(token.jti, token.expires)
+    return send_result(message='Token revoked')
+
+
+@api.route('/tokens/keys', methods=['GET'])
+def get_token_keys():
+    """
+    Public key set api, used by other services to verify tokens locally
+
+    Returns:
+            {
+                "keys": list of JWK, "kid" of each key matches "kid" header of tokens
+            }
+    """
+    return send_result(data=key_ring.jwks)
@@ -0,0 +1,33 @@
+from flask import Blueprint
+from auth_app.api.helper import send_result
+from auth_app.extensions import log_handler
+from auth_app.token_writer import token_writer
+from auth_app.revocation import revocation_store
+from auth_app.pruner import token_pruner
+from auth_app.hashing import password_hasher
+
+api = Blueprint('stats', __name__)
+
+
+@api.route('', methods=['GET'])
+def get_stats():
+    """
+    Runtime counters of current worker
+    Returns:
+            {
+                "log": queued, dropped and sampled out log records,
+                "token_writer": counters of token inserts,
+                "revocation": counters of revocation checks,
+                "token_pruner": pruned tokens, last run with rows pruned per second and token table size,
+                "password_hasher": counters of password hashing pool
+            }
+    """
+
+    data = {
+        'log': log_handler.stats(),
+        'token_writer': token_writer.counters,
+        'revocation': revocation_store.stats(),
+        'token_pruner': token_pruner.stats(),
+        'password_hasher': password_hasher.stats(),
+    }
+    return send_result(data=data)
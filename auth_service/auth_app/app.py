@@ -2,7 +2,13 @@
 
 from flask import Flask
 from auth_app.api.helper import CONFIG
-from auth_app.extensions import jwt, db, migrate
+from auth_app.metrics import metrics
+from auth_app.extensions import jwt, db, migrate, redis, key_ring, log_handler
+from auth_app.token_writer import token_writer
+from auth_app.revocation import revocation_store
+from auth_app.pruner import token_pruner
+from auth_app.hashing import password_hasher
+from auth_app.commands import token_cli, password_cli, user_cli
 from .api import v1 as api_v1
 from auth_app.models import User, Token  # Must have to migrate db
 
@@ -17,6 +23,7 @@ def create_app(config_object=CONFIG):
     app.config.from_object(config_object)
     register_extensions(app)
     register_blueprints(app)
+    register_commands(app)
     return app
 
 
@@ -27,10 +34,18 @@ def register_extensions(app):
     :return:
     """
 
+    log_handler.init_app(app)
+    metrics.init_app(app)
     db.app = app
     db.init_app(app)  # SQLAlchemy
     jwt.init_app(app)
+    key_ring.init_app(app, jwt)
     migrate.init_app(app, db)
+    redis.init_app(app)
+    revocation_store.init_app(app, jwt)
+    token_writer.init_app(app)
+    token_pruner.init_app(app)
+    password_hasher.init_app(app)
 
 
 def register_blueprints(app):
@@ -40,3 +55,15 @@ def register_blueprints(app):
     :return:
     """
     app.register_blueprint(api_v1.auth.api, url_prefix='/api/v1/auth')
+    app.register_blueprint(api_v1.stats.api, url_prefix='/api/v1/stats')
+
+
+def register_commands(app):
+    """
+    Init flask cli commands
+    :param app:
+    :return:
+    """
+    app.cli.add_command(token_cli)
+    app.cli.add_command(password_cli)
+    app.cli.add_command(user_cli)
@@ -0,0 +1,326 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, inspect, select, text, and_, or_
+from auth_app.extensions import db
+from auth_app.ids import new_id, migrate_table
+from auth_app.models import Token, User
+from auth_app.pruner import token_pruner
+from auth_app.hashing import password_hasher, HashingBusy
+from auth_app.revocation import revocation_store
+from auth_app.token_writer import token_writer
+from auth_app.utils import get_timestamp_now, normalize_email
+from auth_app.validator import (SignupBodyValidation, LoginBodyValidation, LogoutBodyValidation,
+                                RevokeTokenBodyValidation, signup_validator, login_validator, logout_validator,
+                                revoke_token_validator)
+
+token_cli = AppGroup('tokens', help='Token table commands.')
+password_cli = AppGroup('passwords', help='Password hashing commands.')
+user_cli = AppGroup('users', help='User table commands.')
+
+
+@token_cli.command('prune')
+@click.option('--batch-size', default=None, type=int, help='Max rows per delete, default TOKEN_PRUNE_BATCH_SIZE.')
+@click.option('--pause', default=None, type=float, help='Seconds between deletes, default TOKEN_PRUNE_PAUSE.')
+@click.option('--max-batches', default=None, type=int, help='Stop after this number of deletes, rerun to continue.')
+def prune_tokens(batch_size, pause, max_batches):
+    """
+    Delete expired tokens in small batches
+    """
+
+    click.echo(f'Token table rows: {Token.count_rows()}')
+
+    def on_progress(progress):
+        click.echo(f'batch {progress["batches"]}: pruned {progress["pruned"]} tokens in {progress["duration"]:.1f}s')
+
+    summary = token_pruner.run(batch_size, pause, max_batches, on_progress)
+    state = 'finished' if summary['finished'] else 'stopped, run again to continue'
+    click.echo(f'Pruned {summary["pruned"]} tokens expired before {summary["cutoff"]} '
+               f'in {summary["duration"]}s ({summary["rows_per_second"]} rows/s), {state}')
+    click.echo(f'Token table rows: {Token.count_rows()}')
+
+
+@token_cli.command('benchmark-validate')
+@click.option('--requests', 'total', default=2000, help='Validate requests per mode.')
+@click.option('--revoked', default=10000, help='Insert this number of revoked tokens before running.')
+def benchmark_validate(total, revoked):
+    """
+    Throughput of token validate api without revocation check, with revocation set only and with bloom filter
+    """
+
+    app = current_app._get_current_object()
+    prefix = 'benchmark-' + uuid.uuid4().hex[:8]
+    identity = new_id()
+    expires = get_timestamp_now() + 3600
+    for i in range(0, revoked, 1000):
+        Token.add_tokens_to_database([
+            {'id': new_id(), 'jti': f'{prefix}-{n}', 'token_type': 'access', 'user_identity': identity,
+             'expires': expires, 'revoked': True}
+            for n in range(i, min(i + 1000, revoked))])
+    access_token = create_access_token(identity=identity)
+    headers = {'Authorization': 'Bearer ' + access_token}
+
+    modes = [
+        ('no-revocation-check', False, False),
+        ('revocation-set', True, False),
+        ('bloom-filter', True, True),
+    ]
+    blacklist_enabled = app.config['JWT_BLACKLIST_ENABLED']
+    filter_enabled = revocation_store.filter_enabled
+    client = app.test_client()
+    try:
+        for name, check_revoked, use_filter in modes:
+            app.config['JWT_BLACKLIST_ENABLED'] = check_revoked
+            revocation_store.filter_enabled = use_filter
+            revocation_store.reset()
+            client.get('/api/v1/auth/tokens/validate', headers=headers)  # warm up, loads filter
+            start = time.perf_counter()
+            for _ in range(total):
+                response = client.get('/api/v1/auth/tokens/validate', headers=headers)
+            duration = time.perf_counter() - start
+            click.echo(f'{name:<20} status={response.status_code} {total / duration:.0f} req/s '
+                       f'mean={duration / total * 1000:.3f}ms')
+    finally:
+        app.config['JWT_BLACKLIST_ENABLED'] = blacklist_enabled
+        revocation_store.filter_enabled = filter_enabled
+        Token.query.filter(Token.user_identity == identity).delete(synchronize_session=False)
+        db.session.commit()
+        revocation_store.reset()
+    click.echo(f'Revocation stats: {revocation_store.stats()}')
+
+
+@password_cli.command('benchmark')
+@click.option('--workers', 'workers_list', multiple=True, type=int, default=[0, 1, 2, 4],
+              help='Hashing pool size to run, can be repeated. 0 hashes in the request thread.')
+@click.option('--logins', default=200, help='Password checks per pool size.')
+@click.option('--concurrency', default=16, help='Request threads checking passwords at the same time.')
+def benchmark_passwords(workers_list, logins, concurrency):
+    """
+    Logins per second, i.e. password checks with PASSWORD_HASH_METHOD, against number of pool workers
+    """
+
+    config = current_app.config
+    password_hash = password_hasher.hash('benchmark-password')
+
+    def login(_):
+        start = time.perf_counter()
+        try:
+            password_hasher.check(password_hash, 'benchmark-password')
+        except HashingBusy:
+            return None
+        return time.perf_counter() - start
+
+    try:
+        for workers in workers_list:
+            password_hasher.configure(config['PASSWORD_HASH_METHOD'], workers, config['PASSWORD_HASH_MAX_PENDING'],
+                                      config['PASSWORD_HASH_TIMEOUT'])
+            login(0)  # warm up, starts the pool
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(login, range(logins)))
+            duration = time.perf_counter() - start
+            durations = sorted(result for result in results if result is not None)
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000 if durations else 0
+            click.echo(f'workers={workers:<3} {len(durations) / duration:.1f} logins/s p95={p95:.1f}ms '
+                       f'rejected={len(results) - len(durations)}')
+    finally:
+        password_hasher.init_app(current_app)
+
+
+@user_cli.command('migrate-ids')
+@click.option('--batch-size', default=1000, help='Users copied per transaction.')
+@click.option('--drop-old', is_flag=True, help='Drop user_old once users are copied.')
+def migrate_user_ids(batch_size, drop_old):
+    """
+    Convert user table to 16 bytes binary ids, see ids.migrate_table. Stop the service first. Ids keep their
+    string form, so identities of issued tokens stay valid. Can be run again.
+    """
+
+    copied = migrate_table(db.engine, User.__table__, ['id'], batch_size, drop_old, click.echo)
+    click.echo(f'Done: {copied} users copied')
+
+
+@token_cli.command('migrate-ids')
+@click.option('--batch-size', default=1000, help='Tokens copied per transaction.')
+@click.option('--drop-old', is_flag=True, help='Drop token_old once tokens are copied.')
+def migrate_token_ids(batch_size, drop_old):
+    """
+    Convert token table to 16 bytes binary id and user_identity, see ids.migrate_table. Stop the service first.
+    Can be run again.
+    """
+
+    copied = migrate_table(db.engine, Token.__table__, ['id', 'user_identity'], batch_size, drop_old, click.echo)
+    click.echo(f'Done: {copied} tokens copied')
+
+
+@user_cli.command('migrate-email-key')
+@click.option('--batch-size', default=1000, help='Users updated per transaction.')
+def migrate_email_key(batch_size):
+    """
+    Add user.email_key to an existing database, fill it and create its unique index. Can be run again.
+    When several users have the same normalised email the oldest keeps it, the others are listed and left
+    without key, so they can not log in until they are merged.
+    """
+
+    inspector = inspect(db.engine)
+    table = db.engine.dialect.identifier_preparer.quote(User.__tablename__)
+    if 'email_key' not in [column['name'] for column in inspector.get_columns(User.__tablename__)]:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN email_key VARCHAR(100)'))
+        db.session.commit()
+        click.echo('Added column user.email_key')
+
+    # oldest users first, by keyset on (created_date, id)
+    updated = 0
+    duplicates = []
+    last = None
+    while True:
+        query = db.session.query(User.id, User.email, User.created_date).filter(User.email_key.is_(None))
+        if last is not None:
+            query = query.filter(or_(User.created_date > last[0],
+                                     and_(User.created_date == last[0], User.id > last[1])))
+        rows = query.order_by(User.created_date, User.id).limit(batch_size).all()
+        if not rows:
+            break
+        last = (rows[-1].created_date, rows[-1].id)
+
+        keys = {}
+        for row in rows:
+            if row.email:
+                keys.setdefault(normalize_email(row.email), []).append(row)
+        taken = {key for key, in db.session.query(User.email_key).filter(User.email_key.in_(list(keys)))}
+        for key, users in keys.items():
+            first, others = (None, users) if key in taken else (users[0], users[1:])
+            if first is not None:
+                User.query.filter(User.id == first.id).update({'email_key': key}, synchronize_session=False)
+                updated += 1
+            duplicates += [(user.id, user.email) for user in others]
+        db.session.commit()
+        click.echo(f'Filled email_key of {updated} users')
+
+    index = next(index for index in User.__table__.indexes if index.name == 'ix_user_email_key')
+    if index.name not in [index['name'] for index in inspect(db.engine).get_indexes(User.__tablename__)]:
+        index.create(bind=db.engine)
+        click.echo(f'Created unique index {index.name}')
+
+    for _id, email in duplicates:
+        click.echo(f'Duplicated email, left without key: user {_id} {email}')
+    click.echo(f'Done: {updated} users updated, {len(duplicates)} duplicated')
+
+
+@user_cli.command('benchmark-login')
+@click.option('--users', 'user_counts', multiple=True, type=int, default=[1000, 10000, 100000],
+              help='User table size to measure at, can be repeated.')
+@click.option('--logins', default=200, help='Lookups per user table size.')
+def benchmark_login(user_counts, logins):
+    """
+    Latency of login user lookup, scan on email against indexed email_key, as user count grows.
+    Password check is left out, its cost does not depend on user count. Then queries per call of login api.
+    """
+
+    prefix = 'benchmark-' + uuid.uuid4().hex[:8]
+    password_hash = password_hasher.hash('bench1234')  # valid for login api
+    now = get_timestamp_now()
+    total = 0
+    try:
+        for user_count in sorted(user_counts):
+            for i in range(total, user_count, 1000):
+                db.session.execute(User.__table__.insert(), [
+                    {'id': new_id(), 'email': f'{prefix}-{n}@Example.com',
+                     'email_key': normalize_email(f'{prefix}-{n}@Example.com'), 'password_hash': password_hash,
+                     'created_date': now, 'modified_date': 0, 'is_deleted': False, 'is_active': True}
+                    for n in range(i, min(i + 1000, user_count))])
+                db.session.commit()
+            total = max(total, user_count)
+
+            emails = [f'{prefix}-{n * 7919 % total}@Example.com' for n in range(logins)]
+            paths = [
+                ('scan email', lambda email: User.query.filter(User.email == email).first()),
+                ('email_key', User.get_credentials),
+            ]
+            for name, lookup in paths:
+                durations = []
+                for email in emails:
+                    start = time.perf_counter()
+                    assert lookup(email) is not None
+                    durations.append(time.perf_counter() - start)
+                    db.session.expunge_all()
+                durations.sort()
+                click.echo(f'users={total:<8} {name:<11} mean={sum(durations) / len(durations) * 1000:.3f}ms '
+                           f'p95={durations[int(len(durations) * 0.95)] * 1000:.3f}ms')
+
+        # whole login api, with password check and token write
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.split(None, 1)[0].upper())
+
+        client = current_app.test_client()
+        calls = min(logins, 20)
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            for n in range(calls):
+                res = client.post('/api/v1/auth/login', json={'email': f'{prefix}-{n}@Example.com',
+                                                              'password': 'bench1234'})
+                assert res.json['message']['status'] == 'success', res.json
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        click.echo(f'login api   queries/login={len(statements) / calls:.1f} '
+                   f'selects/login={statements.count("SELECT") / calls:.1f}')
+    finally:
+        token_writer.flush()  # tokens of login api may still be queued
+        user_ids = select(User.id).where(User.email_key.like(f'{prefix}-%'))
+        Token.query.filter(Token.user_identity.in_(user_ids)).delete(synchronize_session=False)
+        User.query.filter(User.email_key.like(f'{prefix}-%')).delete(synchronize_session=False)
+        db.session.commit()
+
+
+@user_cli.command('benchmark-validation')
+@click.option('--repeat', default=20000, help='Validations per endpoint and path.')
+def benchmark_validation(repeat):
+    """
+    Validations per second of request bodies: trim loop and new schema per request against compiled validators.
+    Also checks both give the same errors on valid and invalid bodies.
+    """
+
+    def trim_strings(body):
+        return {key: value.strip() if isinstance(value, str) else value for key, value in body.items()}
+
+    def trim_all(body):
+        return {key: str(value).strip() for key, value in body.items()}
+
+    def no_trim(body):
+        return body
+
+    credentials = [
+        {'email': ' sy123456@gmail.com ', 'password': '123456aA@'},
+        {'email': 'not-an-email', 'password': 'short'},
+        {'email': 'sy123456@gmail.com', 'password': 123456789, 'extra': 1},
+        {'password': 'x' * 40},
+    ]
+    endpoints = [
+        ('signup', SignupBodyValidation, trim_strings, signup_validator, credentials),
+        ('login', LoginBodyValidation, trim_all, login_validator, credentials),
+        ('logout', LogoutBodyValidation, no_trim, logout_validator,
+         [{'refresh_token': 'eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9.e30.sig'}, {}, {'refresh_token': ''}, []]),
+        ('revoke', RevokeTokenBodyValidation, no_trim, revoke_token_validator,
+         [{'jti': str(uuid.uuid4())}, {}, {'jti': 'x' * 37, 'other': None}]),
+    ]
+    for name, schema_class, trim, validator, bodies in endpoints:
+        def schema_path(body):
+            if not isinstance(body, dict):
+                return schema_class().validate(body)
+            return schema_class().validate(trim(body))
+
+        mismatches = sum(1 for body in bodies if schema_path(body) != validator.validate(body)[1])
+        rates = []
+        for fn in (schema_path, validator.validate):
+            start = time.perf_counter()
+            for i in range(repeat):
+                fn(bodies[i % len(bodies)])
+            rates.append(repeat / (time.perf_counter() - start))
+        click.echo(f'{name:<7} schema={rates[0]:>9,.0f}/s compiled={rates[1]:>9,.0f}/s '
+                   f'x{rates[1] / rates[0]:.1f} mismatches={mismatches}')
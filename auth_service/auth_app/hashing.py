@@ -0,0 +1,115 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+from auth_app.extensions import logger
+from auth_app.metrics import metrics
+
+
+class HashingBusy(Exception):
+    """
+    Too many passwords waiting for the hashing pool, retry later
+    """
+
+
+class PasswordHasher(object):
+    """
+    Hash and check passwords in a pool of PASSWORD_HASH_WORKERS processes, so a login burst uses at most that
+    many CPUs and request threads stay free for cheap requests. The request thread waits for the result.
+    At most PASSWORD_HASH_MAX_PENDING passwords wait for the pool, more fail at once with HashingBusy.
+    With PASSWORD_HASH_WORKERS = 0 passwords are hashed in the request thread.
+
+    Cost is PASSWORD_HASH_METHOD, hashes made with another method are upgraded on next login, see needs_rehash.
+    """
+
+    def __init__(self):
+        self.method = 'pbkdf2:sha256:260000'
+        self.salt_length = 16
+        self.workers = 0
+        self.max_pending = 0
+        self.timeout = 10
+        self.counters = {'hashed': 0, 'checked': 0, 'rehashed': 0, 'rejected': 0, 'timeouts': 0}
+        self._executor = None
+        self._pending = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.configure(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+                       app.config['PASSWORD_HASH_MAX_PENDING'], app.config['PASSWORD_HASH_TIMEOUT'])
+
+    def configure(self, method: str, workers: int, max_pending: int, timeout: float = 10) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self.method = method
+            self.workers = workers
+            self.max_pending = max_pending
+            self.timeout = timeout
+            self._executor = None
+            self._pid = None
+
+    def hash(self, password: str) -> str:
+        self.counters['hashed'] += 1
+        with metrics.timed('hash'):
+            return self._call(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        self.counters['checked'] += 1
+        with metrics.timed('hash'):
+            return self._call(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Hash was made with another method or cost than PASSWORD_HASH_METHOD
+        """
+
+        return password_hash.split('$', 1)[0] != self.method
+
+    def stats(self) -> dict:
+        return dict(self.counters, workers=self.workers, method=self.method)
+
+    def _call(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        executor, pending = self._get_executor()
+        if not pending.acquire(blocking=False):
+            self.counters['rejected'] += 1
+            raise HashingBusy()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            pending.release()
+            self._reset(executor)
+            raise HashingBusy()
+        future.add_done_callback(lambda _: pending.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.counters['timeouts'] += 1
+            raise HashingBusy()
+        except BrokenProcessPool:
+            # a worker died, start a new pool on next call
+            logger.error('Password hashing pool is broken, restart it')
+            self._reset(executor)
+            raise HashingBusy()
+
+    def _get_executor(self) -> tuple:
+        # process pools do not survive fork, start one per worker process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pending = threading.BoundedSemaphore(self.workers + self.max_pending)
+                    self._pid = os.getpid()
+        return self._executor, self._pending
+
+    def _reset(self, executor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._pid = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,107 @@
+import glob
+import json
+import os
+import uuid
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+
+class KeyRing(object):
+    """
+    Asymmetric signing keys of auth_service.
+
+    Every "<kid>.pem" file in JWT_KEYS_DIR is a RSA private key. The one named by JWT_ACTIVE_KID signs
+    new tokens, the others are only kept to verify tokens signed before a rotation. All public keys
+    are published as a key set so other services can verify tokens without calling auth_service.
+    """
+
+    def __init__(self):
+        self.active_kid = None
+        self.private_keys = {}
+        self.public_keys = {}
+        self.jwks = {'keys': []}
+
+    def init_app(self, app, jwt_manager):
+        """
+        Load keys and register them to JWTManager
+        :param app:
+        :param jwt_manager:
+        :return:
+        """
+
+        keys_dir = app.config['JWT_KEYS_DIR']
+        self.active_kid = app.config['JWT_ACTIVE_KID']
+        self.load(keys_dir)
+        if self.active_kid not in self.private_keys:
+            if not app.config.get('JWT_GENERATE_KEYS'):
+                raise RuntimeError(f'Signing key "{self.active_kid}" not found in {keys_dir}')
+            self.generate(keys_dir, self.active_kid)
+            self.load(keys_dir)
+
+        jwt_manager.encode_key_loader(self.get_signing_key)
+        jwt_manager.decode_key_loader(self.get_verifying_key)
+        jwt_manager.additional_headers_loader(self.get_headers)
+
+    def load(self, keys_dir: str) -> None:
+        """
+        Read all private keys in keys_dir
+        :param keys_dir:
+        :return:
+        """
+
+        private_keys = {}
+        for path in sorted(glob.glob(os.path.join(keys_dir, '*.pem'))):
+            kid = os.path.splitext(os.path.basename(path))[0]
+            with open(path, 'rb') as f:
+                private_keys[kid] = serialization.load_pem_private_key(f.read(), password=None,
+                                                                       backend=default_backend())
+        public_keys = {kid: key.public_key() for kid, key in private_keys.items()}
+        jwks = []
+        for kid, key in public_keys.items():
+            jwk = json.loads(RSAAlgorithm.to_jwk(key))
+            jwk.update({'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+            jwks.append(jwk)
+
+        self.private_keys = private_keys
+        self.public_keys = public_keys
+        self.jwks = {'keys': jwks}
+
+    @staticmethod
+    def generate(keys_dir: str, kid: str = None) -> str:
+        """
+        Create a new RSA private key file in keys_dir
+        :param keys_dir:
+        :param kid: key id, random if not set
+        :return: key id
+        """
+
+        kid = kid or str(uuid.uuid4())
+        os.makedirs(keys_dir, exist_ok=True)
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        pem = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                        format=serialization.PrivateFormat.PKCS8,
+                                        encryption_algorithm=serialization.NoEncryption())
+        tmp_path = os.path.join(keys_dir, f'.{kid}.{os.getpid()}.tmp')
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pem)
+        try:
+            # link is atomic: when several workers start together only the first key is kept
+            os.link(tmp_path, os.path.join(keys_dir, f'{kid}.pem'))
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+        return kid
+
+    def get_signing_key(self, identity):
+        return self.private_keys[self.active_kid]
+
+    def get_verifying_key(self, claims, headers):
+        # unknown kid falls back to active key, the signature check will reject the token
+        return self.public_keys.get(headers.get('kid'), self.public_keys[self.active_kid])
+
+    def get_headers(self, identity):
+        return {'kid': self.active_kid}
@@ -0,0 +1,177 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, _app_ctx_stack, _request_ctx_stack
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram(object):
+    """
+    Prometheus style histogram: count per bucket, sum and count of observed seconds
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+def label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    """
+    Time every request and its phases: queries (SQLAlchemy cursor events) and whatever runs in timed(phase).
+
+    Phases of a request are sent back in a Server-Timing header and aggregated with the request duration in
+    histograms by endpoint, exposed in Prometheus text format on /metrics. Phases may overlap, e.g. db time of
+    a search is also in the search phase. Bodies streamed after the view returns are not timed. Histograms are
+    per worker process, scrape each worker or run one worker per container.
+    """
+
+    _listening = False
+
+    def __init__(self):
+        self.enabled = False
+        self.server_timing = False
+        self.requests = {}  # (endpoint, method, status) -> Histogram
+        self.phases = {}  # (endpoint, phase) -> Histogram
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+        self.server_timing = app.config['SERVER_TIMING_ENABLED']
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        if not Metrics._listening:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            Metrics._listening = True
+
+    @contextmanager
+    def timed(self, phase: str):
+        """
+        Add time spent in the block to phase of current request, no-op outside requests
+        """
+
+        timings = self._get_timings()
+        if timings is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(timings, phase, time.perf_counter() - start)
+
+    def add(self, phase: str, seconds: float) -> None:
+        timings = self._get_timings()
+        if timings is not None:
+            self._add(timings, phase, seconds)
+
+    def _get_timings(self):
+        # runs a few times per request, look up the context once instead of through the g proxy
+        ctx = _app_ctx_stack.top
+        if ctx is None:
+            return None
+        # query events fire for every engine, only count those of requests timed by this instance
+        if getattr(ctx.g, 'metrics', None) is not self:
+            return None
+        return ctx.g.timings
+
+    @staticmethod
+    def _add(timings: dict, phase: str, seconds: float) -> None:
+        timing = timings.get(phase)
+        if timing is None:
+            timings[phase] = [seconds, 1]
+        else:
+            timing[0] += seconds
+            timing[1] += 1
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self) -> str:
+        with self._lock:
+            requests = sorted(self.requests.items())
+            phases = sorted(self.phases.items())
+            lines = ['# HELP http_request_duration_seconds Duration of requests until the response is returned.',
+                     '# TYPE http_request_duration_seconds histogram']
+            for (endpoint, method, status), histogram in requests:
+                labels = f'endpoint="{label_value(endpoint)}",method="{method}",status="{status}"'
+                lines += histogram.render('http_request_duration_seconds', labels)
+            lines += ['# HELP http_request_phase_duration_seconds Time of each phase of a request, summed per request.',
+                      '# TYPE http_request_phase_duration_seconds histogram']
+            for (endpoint, phase), histogram in phases:
+                labels = f'endpoint="{label_value(endpoint)}",phase="{label_value(phase)}"'
+                lines += histogram.render('http_request_phase_duration_seconds', labels)
+        return '\n'.join(lines) + '\n'
+
+    def _start_request(self) -> None:
+        g = _app_ctx_stack.top.g
+        g.metrics = self
+        g.timings = {}
+        g.request_start = time.perf_counter()
+
+    def _end_request(self, response: Response) -> Response:
+        g = _app_ctx_stack.top.g
+        if getattr(g, 'metrics', None) is not self:
+            return response
+        duration = time.perf_counter() - g.request_start
+        timings = g.timings
+        request = _request_ctx_stack.top.request
+        key = (request.endpoint or 'unmatched', request.method, response.status_code)
+        with self._lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram()
+            histogram.observe(duration)
+            for phase, (seconds, _) in timings.items():
+                histogram = self.phases.get((key[0], phase))
+                if histogram is None:
+                    histogram = self.phases[(key[0], phase)] = Histogram()
+                histogram.observe(seconds)
+
+        if self.server_timing:
+            entries = [f'{phase};dur={seconds * 1000:.2f};desc="{count}x"' for phase, (seconds, count) in timings.items()]
+            entries.append(f'total;dur={duration * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(entries)
+        return response
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'query_start', None)
+    if start is not None:
+        metrics.add('db', time.perf_counter() - start)
@@ -1,16 +1,18 @@
 # coding: utf-8
-import uuid
 from flask_jwt_extended import decode_token, get_jwt_identity, get_raw_jwt
+from sqlalchemy import func, text
 from sqlalchemy.dialects.mysql import INTEGER
 from auth_app.extensions import db
-from auth_app.utils import get_timestamp_now
+from auth_app.ids import BinaryId, new_id
+from auth_app.utils import get_timestamp_now, normalize_email
 
 
 class User(db.Model):
     __tablename__ = 'user'
 
-    id = db.Column(db.String(50), primary_key=True)
+    id = db.Column(BinaryId, primary_key=True)  # new_id(), time ordered
     email = db.Column(db.String(100))
+    email_key = db.Column(db.String(100), unique=True, index=True)  # normalize_email(email)
     phone = db.Column(db.String(50))
     password_hash = db.Column(db.String(255))
     created_date = db.Column(INTEGER(unsigned=True), default=get_timestamp_now(), index=True)
@@ -29,16 +31,30 @@ class User(db.Model):
     def get_by_id(cls, _id):
         return cls.query.get(_id)
 
+    @staticmethod
+    def get_credentials(email: str):
+        """
+        Only the columns needed to check a password and answer login, by unique index on email_key
+        :param email:
+        :return: row of id, password_hash and the columns of UserSchema, None if user does not exist
+        """
+        return db.session.query(User.id, User.password_hash, User.email, User.phone, User.created_date,
+                                User.modified_date, User.is_active) \
+            .filter(User.email_key == normalize_email(email)).first()
+
 
 class Token(db.Model):
     __tablename__ = 'token'
+    __table_args__ = (
+        db.Index('ix_token_revoked_expires', 'revoked', 'expires'),  # load revoked tokens not expired yet
+    )
 
-    id = db.Column(db.String(50), primary_key=True)
-    jti = db.Column(db.String(36), nullable=False)
+    id = db.Column(BinaryId, primary_key=True)  # new_id(), time ordered
+    jti = db.Column(db.String(36), nullable=False, unique=True, index=True)
     token_type = db.Column(db.String(10), nullable=False)
-    user_identity = db.Column(db.String(50), nullable=False)
+    user_identity = db.Column(BinaryId, nullable=False)  # user.id
     revoked = db.Column(db.Boolean, nullable=False)
-    expires = db.Column(INTEGER(unsigned=True), nullable=False)
+    expires = db.Column(INTEGER(unsigned=True), nullable=False, index=True)  # prune expired tokens
 
     @staticmethod
     def add_token_to_database(encoded_token, user_identity):
@@ -48,31 +64,101 @@ class Token(db.Model):
         :param user_identity:
         """
         decoded_token = decode_token(encoded_token)
-        jti = decoded_token['jti']
-        token_type = decoded_token['type']
-        expires = decoded_token['exp']
-        revoked = False
-        _id = str(uuid.uuid4())
-
-        db_token = Token(
-            id=_id,
-            jti=jti,
-            token_type=token_type,
-            user_identity=user_identity,
-            expires=expires,
-            revoked=revoked,
-        )
-        db.session.add(db_token)
+        Token.add_tokens_to_database([Token.make_row(decoded_token, user_identity)])
+
+    @staticmethod
+    def make_row(claims: dict, user_identity: str) -> dict:
+        """
+        Row of token table from token claims, not revoked
+        :param claims:
+        :param user_identity:
+        """
+        return {
+            'id': new_id(),
+            'jti': claims['jti'],
+            'token_type': claims['type'],
+            'user_identity': user_identity,
+            'expires': claims['exp'],
+            'revoked': False,
+        }
+
+    @staticmethod
+    def add_tokens_to_database(rows: list):
+        """
+        Adds tokens with one multi-row insert and one commit.
+        :param rows: see make_row
+        """
+        db.session.execute(Token.__table__.insert().values(rows))
         db.session.commit()
 
     @staticmethod
-    def prune_database():
+    def is_revoked(jti: str):
         """
-        Delete tokens that have expired from the database.
-        How (and if) you call this is entirely up you. You could expose it to an
-        endpoint that only administrators could call, you could run it as a cron,
-        set it up with flask cli, etc.
+        Revoked flag of a token by indexed jti
+        :param jti:
+        :return: True/False, None if token is not in database
+        """
+        return db.session.query(Token.revoked).filter(Token.jti == jti).scalar()
+
+    @staticmethod
+    def get_revoked_jtis() -> list:
+        """
+        jti of revoked tokens that are not expired yet
         """
         now_in_seconds = get_timestamp_now()
-        Token.query.filter(Token.expires < now_in_seconds).delete()
+        rows = db.session.query(Token.jti).filter(Token.revoked.is_(True), Token.expires >= now_in_seconds)
+        return [jti for jti, in rows]
+
+    @staticmethod
+    def revoke(jti: str) -> int:
+        """
+        Mark a token as revoked
+        :param jti:
+        :return: number of updated rows
+        """
+        updated = Token.query.filter(Token.jti == jti).update({'revoked': True}, synchronize_session=False)
         db.session.commit()
+        return updated
+
+    @staticmethod
+    def prune_expired(cutoff: int, batch_size: int) -> int:
+        """
+        Delete one batch of tokens expired before cutoff, oldest first, with a range scan on expires
+        :param cutoff: timestamp
+        :param batch_size: max deleted rows
+        :return: number of deleted rows
+        """
+        ids = [_id for _id, in db.session.query(Token.id).filter(Token.expires < cutoff)
+               .order_by(Token.expires).limit(batch_size)]
+        if ids:
+            Token.query.filter(Token.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return len(ids)
+
+    @staticmethod
+    def count_rows() -> int:
+        """
+        Size of token table, estimated by table statistics on MySQL to avoid a full count
+        """
+        if db.engine.dialect.name == 'mysql':
+            rows = db.session.execute(text('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                                           'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name'),
+                                      {'name': Token.__tablename__}).scalar()
+            return int(rows or 0)
+        return db.session.query(func.count(Token.id)).scalar()
+
+    @staticmethod
+    def prune_database(batch_size: int = 1000):
+        """
+        Delete tokens that have expired from the database, in batches so the table is never locked for long.
+        Run it with "flask tokens prune" or TOKEN_PRUNE_SCHEDULER, see auth_app.pruner.
+        :param batch_size:
+        :return: number of deleted rows
+        """
+        now_in_seconds = get_timestamp_now()
+        total = 0
+        while True:
+            deleted = Token.prune_expired(now_in_seconds, batch_size)
+            total += deleted
+            if deleted < batch_size:
+                return total
@@ -0,0 +1,129 @@
+import os
+import random
+import threading
+import time
+from redis import RedisError
+from auth_app.extensions import db, redis, logger
+from auth_app.models import Token
+from auth_app.revocation import revocation_store
+from auth_app.utils import get_timestamp_now
+
+
+class TokenPruner(object):
+    """
+    Delete expired tokens in small batches, oldest first, pausing TOKEN_PRUNE_PAUSE seconds between batches.
+
+    Every batch is committed, an interrupted run loses nothing and the next run continues with the remaining
+    expired rows. Runs from "flask tokens prune", or every TOKEN_PRUNE_INTERVAL seconds in a background thread
+    of each worker with TOKEN_PRUNE_SCHEDULER; TOKEN_PRUNE_LOCK lets only one worker prune per interval.
+    """
+
+    LOCK_KEY = 'auth:prune:lock'
+
+    def __init__(self):
+        self.app = None
+        self.batch_size = 1000
+        self.pause = 0.1
+        self.interval = 3600
+        self.use_lock = False
+        self.counters = {'runs': 0, 'skipped_runs': 0, 'pruned': 0, 'batches': 0, 'errors': 0}
+        self.last_run = None
+        self.progress = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config['TOKEN_PRUNE_BATCH_SIZE']
+        self.pause = app.config['TOKEN_PRUNE_PAUSE']
+        self.interval = app.config['TOKEN_PRUNE_INTERVAL']
+        self.use_lock = app.config['TOKEN_PRUNE_LOCK']
+        if app.config['TOKEN_PRUNE_SCHEDULER']:
+            # threads do not survive fork, start the scheduler in the worker serving requests
+            app.before_request(self.start_scheduler)
+
+    def run(self, batch_size: int = None, pause: float = None, max_batches: int = None, on_progress=None) -> dict:
+        """
+        Prune tokens expired before now
+        :param batch_size: default TOKEN_PRUNE_BATCH_SIZE
+        :param pause: default TOKEN_PRUNE_PAUSE
+        :param max_batches: stop early, the next run continues
+        :param on_progress: called with progress dict after every batch
+        :return: summary of the run
+        """
+
+        batch_size = batch_size or self.batch_size
+        pause = self.pause if pause is None else pause
+        with self._run_lock:
+            started = time.monotonic()
+            self.progress = {'cutoff': get_timestamp_now(), 'pruned': 0, 'batches': 0, 'finished': False}
+            while max_batches is None or self.progress['batches'] < max_batches:
+                deleted = Token.prune_expired(self.progress['cutoff'], batch_size)
+                self.progress['pruned'] += deleted
+                self.progress['batches'] += 1
+                self.counters['pruned'] += deleted
+                self.counters['batches'] += 1
+                if on_progress is not None:
+                    on_progress(dict(self.progress, duration=time.monotonic() - started))
+                if deleted < batch_size:
+                    self.progress['finished'] = True
+                    break
+                time.sleep(pause)
+
+            duration = time.monotonic() - started
+            self.counters['runs'] += 1
+            self.last_run = dict(self.progress, duration=round(duration, 3),
+                                 rows_per_second=round(self.progress['pruned'] / duration, 1) if duration else 0)
+        if self.progress['pruned']:
+            # drop pruned jti from revocation filters
+            revocation_store.reset()
+        return self.last_run
+
+    def stats(self) -> dict:
+        return dict(self.counters, last_run=self.last_run, running=self._run_lock.locked(),
+                    table_rows=Token.count_rows())
+
+    def start_scheduler(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._schedule, name='token-pruner', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _schedule(self) -> None:
+        # spread first runs of workers started together
+        time.sleep(random.uniform(0, min(60, self.interval)))
+        while True:
+            with self.app.app_context():
+                try:
+                    if self._acquire():
+                        summary = self.run()
+                        logger.info('Pruned %s expired tokens in %ss', summary['pruned'], summary['duration'])
+                    else:
+                        self.counters['skipped_runs'] += 1
+                except Exception as ex:
+                    db.session.rollback()
+                    self.counters['errors'] += 1
+                    logger.error('Prune expired tokens failed: %s', ex)
+                finally:
+                    db.session.remove()
+            time.sleep(self.interval)
+
+    def _acquire(self) -> bool:
+        """
+        Take the prune turn of this interval, the lock is not released so other workers skip until it expires
+        """
+
+        if not self.use_lock:
+            return True
+        try:
+            return bool(redis.set(self.LOCK_KEY, os.getpid(), nx=True, ex=max(1, int(self.interval))))
+        except RedisError as ex:
+            # concurrent prunes are safe, only wasteful
+            logger.error('Take token prune lock failed: %s', ex)
+            return True
+
+
+token_pruner = TokenPruner()
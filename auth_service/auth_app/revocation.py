@@ -0,0 +1,254 @@
+import hashlib
+import math
+import threading
+import time
+from redis import RedisError
+from auth_app.extensions import redis, logger
+from auth_app.models import Token
+from auth_app.token_writer import token_writer
+from auth_app.utils import get_timestamp_now
+
+
+class BloomFilter(object):
+    """
+    Probabilistic set: no false negatives, false positives at about error_rate when holding capacity items
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class LocalRevocationSet(object):
+    """
+    Stand-in of redis set for a single process. There is no change log, revocations of other workers are read
+    from token table when filters are rebuilt, every REVOCATION_REBUILD_INTERVAL seconds
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self._jtis = set()
+
+    def add(self, jti: str, expires: int) -> None:
+        self._jtis.add(jti)
+
+    def contains(self, jti: str) -> bool:
+        return jti in self._jtis or bool(Token.is_revoked(jti))
+
+    def position(self):
+        return None
+
+    def changes(self, position):
+        # no change log, filter is rebuilt from token table
+        return None, None
+
+
+class RedisRevocationSet(object):
+    """
+    Revoked jti shared by all workers: one key per jti living until the token expires, and an append only
+    log that workers read to update their filters. reset() drops the log and makes every worker rebuild.
+    """
+
+    name = 'redis'
+    KEY_PREFIX = 'auth:revoked:'
+    LOG_KEY = 'auth:revoked:log'
+    EPOCH_KEY = 'auth:revoked:epoch'
+
+    def add(self, jti: str, expires: int) -> None:
+        pipe = redis.pipeline()
+        pipe.set(self.KEY_PREFIX + jti, 1, ex=max(1, expires - get_timestamp_now()))
+        pipe.rpush(self.LOG_KEY, jti)
+        pipe.execute()
+
+    def contains(self, jti: str) -> bool:
+        return bool(redis.exists(self.KEY_PREFIX + jti))
+
+    def position(self):
+        pipe = redis.pipeline()
+        pipe.get(self.EPOCH_KEY)
+        pipe.llen(self.LOG_KEY)
+        epoch, length = pipe.execute()
+        return epoch, length
+
+    def changes(self, position):
+        """
+        jti revoked since position
+        :param position: (epoch, log length)
+        :return: (new position, list jti), list is None if log was reset and filter must be rebuilt
+        """
+
+        epoch, offset = position
+        pipe = redis.pipeline()
+        pipe.get(self.EPOCH_KEY)
+        pipe.lrange(self.LOG_KEY, offset, -1)
+        current_epoch, jtis = pipe.execute()
+        if current_epoch != epoch:
+            return None, None
+        return (epoch, offset + len(jtis)), [jti.decode() for jti in jtis]
+
+    def reset(self) -> None:
+        pipe = redis.pipeline()
+        pipe.delete(self.LOG_KEY)
+        pipe.incr(self.EPOCH_KEY)
+        pipe.execute()
+
+
+class RevocationStore(object):
+    """
+    Answer "is this token revoked" without touching the database in the common case.
+
+    Each worker keeps a bloom filter of revoked jti, synced every REVOCATION_SYNC_INTERVAL seconds. A jti not in
+    the filter is not revoked, otherwise the shared revocation set is asked, then token table if the jti is not in
+    it, e.g. a filter false positive or a revocation redis could not take. A revocation on another worker is
+    seen after at most REVOCATION_SYNC_INTERVAL seconds with the redis backend. While redis can not be read,
+    tokens are checked in token table, and the filter is rebuilt once it is back.
+    """
+
+    def __init__(self):
+        self.backend = LocalRevocationSet()
+        self.filter_enabled = True
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self.sync_interval = 1
+        self.rebuild_interval = 300
+        self.counters = {'checks': 0, 'filtered': 0, 'lookups': 0, 'revoked': 0, 'rebuilds': 0, 'errors': 0}
+        self._filter = None
+        self._position = None
+        self._synced_at = 0
+        self._rebuilt_at = 0
+        self._stale = False  # revocations may be missing from the filter, redis could not be read
+        self._lock = threading.Lock()
+
+    def init_app(self, app, jwt_manager):
+        """
+        Read config and check every token with JWT_BLACKLIST_ENABLED
+        :param app:
+        :param jwt_manager:
+        :return:
+        """
+
+        jwt_manager.token_in_blacklist_loader(self.check_token)
+        config = app.config
+        self.backend = RedisRevocationSet() if config['REVOCATION_BACKEND'] == 'redis' else LocalRevocationSet()
+        self.filter_enabled = config['REVOCATION_FILTER_ENABLED']
+        self.capacity = config['REVOCATION_FILTER_CAPACITY']
+        self.error_rate = config['REVOCATION_FILTER_ERROR_RATE']
+        self.sync_interval = config['REVOCATION_SYNC_INTERVAL']
+        self.rebuild_interval = config['REVOCATION_REBUILD_INTERVAL']
+        self._filter = None
+
+    def check_token(self, decoded_token: dict) -> bool:
+        return self.is_revoked(decoded_token['jti'])
+
+    def is_revoked(self, jti: str) -> bool:
+        self.counters['checks'] += 1
+        if self.filter_enabled:
+            self._sync()
+            if self._stale:
+                self.counters['lookups'] += 1
+                return bool(Token.is_revoked(jti))
+            if jti not in self._filter:
+                self.counters['filtered'] += 1
+                return False
+
+        self.counters['lookups'] += 1
+        try:
+            # a revocation whose redis write failed is only in token table, and in filters rebuilt from it
+            return self.backend.contains(jti) or bool(Token.is_revoked(jti))
+        except RedisError as ex:
+            self.counters['errors'] += 1
+            logger.error('Check revoked token in redis failed: %s', ex)
+            return bool(Token.is_revoked(jti))
+
+    def revoke(self, jti: str, expires: int) -> None:
+        """
+        Revoke token in token table and add it to revocation set
+        :param jti:
+        :param expires: exp claim of token
+        :return:
+        """
+
+        if not Token.revoke(jti):
+            # token may still be queued by write-behind token writer
+            token_writer.flush()
+            Token.revoke(jti)
+        self.counters['revoked'] += 1
+        try:
+            self.backend.add(jti, expires)
+        except RedisError as ex:
+            # token table is still the source of truth, other workers see it on next rebuild
+            self.counters['errors'] += 1
+            logger.error('Add revoked token to redis failed: %s', ex)
+        if self._filter is not None:
+            self._filter.add(jti)
+
+    def reset(self) -> None:
+        """
+        Make every worker rebuild its filter from token table, e.g. after expired tokens are pruned
+        """
+
+        if isinstance(self.backend, RedisRevocationSet):
+            self.backend.reset()
+        self._filter = None
+
+    def stats(self) -> dict:
+        return dict(self.counters, backend=self.backend.name,
+                    filter_items=self._filter.count if self._filter is not None else 0)
+
+    def _sync(self) -> None:
+        if self._filter is not None and time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            if self._filter is not None and time.monotonic() - self._synced_at < self.sync_interval:
+                return
+            try:
+                # full rebuild from time to time, in case a revocation could not be written to redis
+                if self._filter is None or self._stale or time.monotonic() - self._rebuilt_at >= self.rebuild_interval:
+                    self._rebuild()
+                elif self._position is not None:
+                    self._position, jtis = self.backend.changes(self._position)
+                    if jtis is None:
+                        self._rebuild()
+                    else:
+                        for jti in jtis:
+                            self._filter.add(jti)
+                # else local backend, no change log until next rebuild
+                self._stale = False
+            except RedisError as ex:
+                self.counters['errors'] += 1
+                logger.error('Sync revoked tokens from redis failed: %s', ex)
+                self._stale = True
+                if self._filter is None:
+                    self._rebuild(with_position=False)
+            self._synced_at = time.monotonic()
+
+    def _rebuild(self, with_position: bool = True) -> None:
+        # read log position first, revocations during the rebuild are read again on next sync
+        self._position = self.backend.position() if with_position else None
+        jtis = Token.get_revoked_jtis()
+        bloom_filter = BloomFilter(max(self.capacity, len(jtis) * 2), self.error_rate)
+        for jti in jtis:
+            bloom_filter.add(jti)
+        self._filter = bloom_filter
+        self._rebuilt_at = time.monotonic()
+        self.counters['rebuilds'] += 1
+
+
+revocation_store = RevocationStore()
@@ -0,0 +1,145 @@
+import atexit
+import os
+import queue
+import threading
+import time
+import jwt
+from auth_app.extensions import db, logger
+from auth_app.models import Token
+
+
+class TokenWriter(object):
+    """
+    Record issued tokens in token table.
+
+    Claims are read from the tokens just created, without verifying them again. By default all tokens of a
+    login are written with one insert in the request. With TOKEN_WRITE_BEHIND a background thread batches
+    tokens of many logins into multi-row inserts, at most TOKEN_FLUSH_INTERVAL seconds after they are
+    issued, and flushes the rest when the process exits. When the queue is full tokens are written in the
+    request again.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.write_behind = False
+        self.batch_size = 500
+        self.flush_interval = 0.05
+        self.flush_timeout = 5
+        self.counters = {'queued': 0, 'flushed': 0, 'batches': 0, 'sync_writes': 0, 'errors': 0}
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.write_behind = app.config['TOKEN_WRITE_BEHIND']
+        self.batch_size = app.config['TOKEN_WRITE_BATCH_SIZE']
+        self.flush_interval = app.config['TOKEN_FLUSH_INTERVAL']
+        self.flush_timeout = app.config['TOKEN_FLUSH_TIMEOUT']
+        if self.write_behind:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def get_unverified_claims(encoded_token: str) -> dict:
+        return jwt.decode(encoded_token, verify=False)
+
+    def add_tokens(self, encoded_tokens: list, user_identity: str) -> None:
+        """
+        Record tokens, not revoked
+        :param encoded_tokens:
+        :param user_identity:
+        :return:
+        """
+
+        rows = [Token.make_row(self.get_unverified_claims(token), user_identity) for token in encoded_tokens]
+        if self.write_behind:
+            token_queue = self._get_queue()
+            while rows:
+                try:
+                    token_queue.put_nowait(rows[0])
+                except queue.Full:
+                    break
+                self.counters['queued'] += 1
+                rows.pop(0)
+            if not rows:
+                return
+        self.counters['sync_writes'] += 1
+        Token.add_tokens_to_database(rows)
+
+    def flush(self) -> int:
+        """
+        Write all queued tokens now, and wait up to TOKEN_FLUSH_TIMEOUT seconds for the batch the flusher
+        has taken from the queue
+        :return: number of tokens queued or being written when called, 0 if every token was already written
+        """
+
+        token_queue = self._queue
+        if token_queue is None:
+            return 0
+        # rows count as unfinished from put until written, see _write_batch
+        pending = token_queue.unfinished_tasks
+        while not token_queue.empty():
+            self._write_batch(self._drain(time.monotonic()))
+
+        deadline = time.monotonic() + self.flush_timeout
+        with token_queue.all_tasks_done:
+            while token_queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error('Flush tokens timed out, %s tokens not written yet', token_queue.unfinished_tasks)
+                    break
+                token_queue.all_tasks_done.wait(remaining)
+        return pending
+
+    def _get_queue(self) -> queue.Queue:
+        # threads do not survive fork, start one flusher per worker process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.batch_size * 10)
+                    threading.Thread(target=self._run, name='token-writer', daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get()
+            except Exception:
+                return
+            self._write_batch([first] + self._drain(time.monotonic() + self.flush_interval))
+
+    def _drain(self, deadline: float) -> list:
+        """
+        Take queued rows until batch is full or deadline passed
+        """
+
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_batch(self, rows: list) -> int:
+        if not rows:
+            return 0
+        try:
+            # own connection of the primary, not db.session: flush() also runs in requests, whose session is in use
+            with self._write_lock, db.get_engine(self.app).begin() as connection:
+                connection.execute(Token.__table__.insert().values(rows))
+            self.counters['flushed'] += len(rows)
+            self.counters['batches'] += 1
+        except Exception as ex:
+            self.counters['errors'] += 1
+            logger.error('Write %s tokens failed: %s', len(rows), ex)
+        finally:
+            # rows are taken from the queue, flush() waits until they are marked done
+            for _ in rows:
+                self._queue.task_done()
+        return len(rows)
+
+
+token_writer = TokenWriter()
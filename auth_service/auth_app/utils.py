@@ -4,44 +4,47 @@ import random
 import string
 from abc import ABC
 from html.parser import HTMLParser
-from time import strftime
 
-from flask import request
+from flask import request, has_request_context
 from pytz import timezone
-from .extensions import logger
-from auth_app.enums import TIME_FORMAT_LOG
+from .extensions import logger, log_handler
+
+
+def request_fields() -> dict:
+    """
+    Fields of current request in log records
+    """
+
+    return {
+        'remote_addr': request.remote_addr,
+        'method': request.method,
+        'scheme': request.scheme,
+        'path': request.full_path,
+        'endpoint': request.endpoint,
+    }
 
 
 def logged_error(error: str) -> None:
     """
-    Logged error
+    Logged error, never sampled
     :param error:
     :return:
     """
 
-    logger.info('%s %s %s %s %s ERROR: %s',
-                strftime(TIME_FORMAT_LOG),
-                request.remote_addr,
-                request.method,
-                request.scheme,
-                request.full_path,
-                error)
+    fields = request_fields() if has_request_context() else {}
+    logger.error('ERROR: %s', error, extra={'fields': fields})
 
 
-def logged_input(json_req: str) -> None:
+def logged_input(json_req) -> None:
     """
-    Logged input fields
-    :param json_req:
+    Logged input fields of sampled requests, secret fields redacted before serialisation
+    :param json_req: request body
     :return:
     """
 
-    logger.info('%s %s %s %s %s INPUT FIELDS: %s',
-                strftime(TIME_FORMAT_LOG),
-                request.remote_addr,
-                request.method,
-                request.scheme,
-                request.full_path,
-                json_req)
+    if not log_handler.is_sampled(request.endpoint):
+        return
+    logger.info('INPUT FIELDS', extra={'fields': dict(request_fields(), input=log_handler.redact(json_req))})
 
 
 def get_timestamp_now() -> int:
@@ -53,6 +56,15 @@ def get_timestamp_now() -> int:
     return int(datetime.datetime.now(time_zon_sg).timestamp())
 
 
+def normalize_email(email: str) -> str:
+    """
+    Key of an email, emails with the same key belong to the same user
+    :param email:
+    :return:
+    """
+    return email.strip().lower()
+
+
 # Regex validate
 REGEX_EMAIL = r'^(([^<>()[\]\.,;:\s@\"]+(\.[^<>()[\]\.,;:\s@\"]+)*)|(\".+\"))@(([^<>()[\]\.,;:\s@\"]+\.)+[^<>()[\]\.,' \
               r';:\s@\"]{2,})$'
@@ -1,5 +1,6 @@
 from marshmallow import Schema, fields, validate
 from auth_app.utils import REGEX_EMAIL, REGEX_VALID_PASSWORD
+from auth_app.validation import CompiledValidator, TRIM_ALL, TRIM_STRINGS
 
 
 class LoginBodyValidation(Schema):
@@ -36,6 +37,46 @@ class SignupBodyValidation(Schema):
                              validate=[validate.Length(min=1, max=16), validate.Regexp(REGEX_VALID_PASSWORD)])
 
 
+class LogoutBodyValidation(Schema):
+    """
+    Validate body of logout api
+    :param
+        refresh_token: string, optional
+    Ex:
+    {
+        "refresh_token": "eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9..."
+    }
+    """
+    refresh_token = fields.String(required=False, validate=[validate.Length(min=1, max=2000)])
+
+
+class RevokeTokenBodyValidation(Schema):
+    """
+    Validate body of revoke token api
+    :param
+        jti: string, required
+    Ex:
+    {
+        "jti": "ce641be5-a131-4a63-bbf2-43108c250f27"
+    }
+    """
+    jti = fields.String(required=True, validate=[validate.Length(min=1, max=36)])
+
+
+class ValidateTokensBodyValidation(Schema):
+    """
+    Validate body of validate tokens batch api, max number of tokens is TOKEN_VALIDATE_MAX_BATCH.
+    Tokens are not checked one by one, a malformed token is reported invalid without failing the others
+    :param
+        tokens: list of string, required
+    Ex:
+    {
+        "tokens": ["eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9...", "eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9..."]
+    }
+    """
+    tokens = fields.List(fields.Raw(), required=True, validate=[validate.Length(min=1)])
+
+
 class UserSchema(Schema):
     """
     User Schema
@@ -48,3 +89,11 @@ class UserSchema(Schema):
     created_date = fields.Number()
     modified_date = fields.Number()
     is_active = fields.Boolean()
+
+
+# compiled once at import, apis validate with these instead of a schema instance per request
+signup_validator = CompiledValidator(SignupBodyValidation, trim=TRIM_STRINGS)
+login_validator = CompiledValidator(LoginBodyValidation, trim=TRIM_ALL)
+logout_validator = CompiledValidator(LogoutBodyValidation)
+revoke_token_validator = CompiledValidator(RevokeTokenBodyValidation)
+validate_tokens_validator = CompiledValidator(ValidateTokensBodyValidation)
@@ -0,0 +1,19 @@
+from flask_jwt_extended import create_access_token, decode_token
+from auth_app.extensions import db
+from auth_app.models import Token, User
+
+
+def warm_up(app):
+    """
+    Do the one-off work of first requests before serving: database dialect setup, statement compilation,
+    RSA key setup of the signing library. Run in gunicorn master, workers forked from it start warm.
+    Pooled connections are closed at the end so workers open their own.
+    :param app:
+    :return:
+    """
+
+    with app.test_request_context():
+        db.replica_or_primary(User.get_credentials, 'warmup@example.com')
+        Token.is_revoked('warmup')
+        decode_token(create_access_token(identity='warmup'))
+    db.dispose(app)
@@ -0,0 +1,32 @@
+"""
+gunicorn settings of auth_service, from SERVER_* config
+
+    gunicorn -c gunicorn.conf.py
+
+The app is loaded and warmed up once in the master, workers are forked from it and share its memory
+copy-on-write. Each worker opens SERVER_WARMUP_CONNECTIONS database connections before it accepts requests.
+"""
+import gc
+import os
+from auth_app.settings import CONFIG
+
+wsgi_app = 'server:app'
+bind = CONFIG.SERVER_BIND
+worker_class = CONFIG.SERVER_WORKER_CLASS
+# password hashing pools of the workers need cores too
+workers = CONFIG.SERVER_WORKERS or os.cpu_count()
+threads = CONFIG.SERVER_THREADS
+timeout = CONFIG.SERVER_TIMEOUT
+preload_app = True
+
+
+def when_ready(server):
+    from auth_app.warmup import warm_up
+    warm_up(server.app.wsgi())
+    # objects loaded so far live as long as the process, keep gc from touching (and copying) their pages in workers
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    from auth_app.extensions import db
+    db.warm_pool(CONFIG.SERVER_WARMUP_CONNECTIONS, worker.wsgi)
@@ -4,6 +4,7 @@ app = create_app()
 if __name__ == '__main__':
     """
     Main Auth Application
-    python manage.py
+    python server.py
+    in production: gunicorn -c gunicorn.conf.py
     """
     app.run(host='0.0.0.0', port=5012)
@@ -0,0 +1,57 @@
+import pytest
+from redis import RedisError
+from auth_app.app import create_app
+from auth_app.extensions import db
+from auth_app.revocation import RedisRevocationSet, revocation_store
+from auth_app.settings import StgConfig
+
+
+class BrokenRevocationSet(RedisRevocationSet):
+    """
+    Redis taking reads but not writes
+    """
+
+    def add(self, jti: str, expires: int) -> None:
+        raise RedisError('Connection reset by peer')
+
+    def contains(self, jti: str) -> bool:
+        return False
+
+    def position(self):
+        return None, 0
+
+    def changes(self, position):
+        return position, []
+
+    def reset(self) -> None:
+        pass
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(StgConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "auth.db"}'
+        JWT_KEYS_DIR = str(tmp_path / 'keys')
+        REVOCATION_BACKEND = 'redis'
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    revocation_store.backend = BrokenRevocationSet()
+    return app
+
+
+def test_revoked_token_is_rejected_when_redis_write_fails(app):
+    client = app.test_client()
+    client.post('/api/v1/auth/signup', json={'email': 'a@b.com', 'password': 'abcd1234'})
+    tokens = client.post('/api/v1/auth/login', json={'email': 'a@b.com', 'password': 'abcd1234'}).json['data']
+    headers = {'Authorization': f'Bearer {tokens["access_token"]}'}
+    assert client.get('/api/v1/auth/tokens/validate', headers=headers).status_code == 200
+
+    assert client.post('/api/v1/auth/logout', headers=headers, json={}).status_code == 200
+    assert revocation_store.counters['errors'] >= 1
+    assert client.get('/api/v1/auth/tokens/validate', headers=headers).status_code == 401
+
+    # filters rebuilt from token table still find it
+    revocation_store.reset()
+    assert client.get('/api/v1/auth/tokens/validate', headers=headers).status_code == 401
@@ -0,0 +1,36 @@
+import os
+import queue
+import pytest
+from auth_app.app import create_app
+from auth_app.extensions import db
+from auth_app.models import Token, User
+from auth_app.settings import StgConfig
+from auth_app.token_writer import token_writer
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(StgConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "auth.db"}'
+        JWT_KEYS_DIR = str(tmp_path / 'keys')
+        TOKEN_WRITE_BEHIND = True
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def test_flush_keeps_session_of_request(app, monkeypatch):
+    # no flusher thread, tokens stay queued until flushed in the request
+    monkeypatch.setattr(token_writer, '_queue', queue.Queue())
+    monkeypatch.setattr(token_writer, '_pid', os.getpid())
+    client = app.test_client()
+    client.post('/api/v1/auth/signup', json={'email': 'a@b.com', 'password': 'abcd1234'})
+    client.post('/api/v1/auth/login', json={'email': 'a@b.com', 'password': 'abcd1234'})
+
+    with app.test_request_context():
+        user = User.query.first()
+        assert token_writer.flush() == 2
+        assert user in db.session
+        assert Token.query.filter(Token.user_identity == user.id).count() == 2
@@ -0,0 +1,148 @@
+"""
+Startup benchmark of auth_service and video_service: import time and time to first response.
+
+    python benchmarks/startup.py --workers 2
+    python benchmarks/startup.py --service video --importtime 15
+
+For each service it reports the time to import the app package and to run create_app, in a fresh interpreter.
+It then starts gunicorn twice on an empty SQLite database: once plain (gunicorn server:app) and once with
+gunicorn.conf.py, which preloads and warms up the app in the master. For each run it reports the time from
+spawn to the first response and the latency of the first requests, which land on cold workers.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    'auth': {
+        'package': 'auth_app',
+        'port': 5112,
+        'request': ('POST', '/api/v1/auth/login', {'json': {'email': 'nobody@example.com', 'password': 'abcd1234'}}),
+    },
+    'video': {
+        'package': 'video_app',
+        'port': 5113,
+        'request': ('GET', '/api/v1/videos', {'params': {'keyword': 'music'}}),
+    },
+}
+IMPORT_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+from {package}.app import create_app
+imported = time.perf_counter()
+create_app()
+print(json.dumps({{'import_s': imported - start, 'create_app_s': time.perf_counter() - imported}}))
+'''
+CREATE_TABLES_SCRIPT = '''
+from {package}.app import create_app
+from {package}.extensions import db
+with create_app().app_context():
+    db.create_all()
+'''
+
+
+def service_env(name: str, workdir: str) -> dict:
+    return dict(os.environ, ENV='stg', DATABASE_URL=f'sqlite:///{os.path.join(workdir, name + ".db")}',
+                PASSWORD_HASH_WORKERS='0', REVOCATION_BACKEND='local', SEARCH_BACKEND='memory',
+                SEARCH_CACHE_BACKEND='local', PYTHONDONTWRITEBYTECODE='1')
+
+
+def measure_import(name: str, env: dict, importtime: int) -> dict:
+    service = SERVICES[name]
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', IMPORT_SCRIPT.format(package=service['package'])]
+    res = subprocess.run(command, cwd=os.path.join(ROOT, f'{name}_service'), env=env, capture_output=True,
+                         text=True, check=True)
+    result = {key: round(value, 3) for key, value in json.loads(res.stdout.strip().splitlines()[-1]).items()}
+    if importtime:
+        # "import time: self [us] | cumulative | imported package", self time summed per top level package
+        packages = {}
+        for line in res.stderr.splitlines():
+            parts = line.split('|')
+            if len(parts) == 3 and parts[0].split(':')[-1].strip().isdigit():
+                package = parts[2].strip().split('.')[0]
+                packages[package] = packages.get(package, 0) + int(parts[0].split(':')[-1])
+        result['slowest_imports_ms'] = {package: round(us / 1000, 1) for package, us in
+                                        sorted(packages.items(), key=lambda item: item[1], reverse=True)[:importtime]}
+    return result
+
+
+def measure_first_response(name: str, env: dict, mode: str, workers: int, requests_count: int) -> dict:
+    service = SERVICES[name]
+    port = service['port']
+    method, path, kwargs = service['request']
+    url = f'http://127.0.0.1:{port}{path}'
+    if mode == 'launcher':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']
+        env = dict(env, SERVER_BIND=f'127.0.0.1:{port}', SERVER_WORKERS=str(workers), SERVER_WORKER_CLASS='sync')
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'server:app']
+
+    start = time.perf_counter()
+    server = subprocess.Popen(command, cwd=os.path.join(ROOT, f'{name}_service'), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        latencies = []
+        while not latencies:
+            if server.poll() is not None:
+                raise SystemExit(f'{name} {mode}: gunicorn exited with {server.returncode}')
+            request_start = time.perf_counter()
+            try:
+                res = requests.request(method, url, timeout=30, **kwargs)
+            except requests.ConnectionError:
+                if time.perf_counter() - start > 60:
+                    raise
+                time.sleep(0.01)
+                continue
+            res.raise_for_status()
+            latencies.append(time.perf_counter() - request_start)
+        first_response = time.perf_counter() - start
+
+        # new connection each time, so requests spread over workers that have not served yet
+        for _ in range(requests_count - 1):
+            request_start = time.perf_counter()
+            requests.request(method, url, timeout=30, headers={'Connection': 'close'}, **kwargs).raise_for_status()
+            latencies.append(time.perf_counter() - request_start)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'first_response_s': round(first_response, 3),
+        'first_request_ms': round(latencies[0] * 1000, 1),
+        'max_request_ms': round(max(latencies) * 1000, 1),
+        'median_request_ms': round(sorted(latencies)[len(latencies) // 2] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--service', action='append', choices=list(SERVICES), help='Default: all services.')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes.')
+    parser.add_argument('--requests', type=int, default=20, help='Requests after start, the first ones hit cold '
+                                                                  'workers.')
+    parser.add_argument('--importtime', type=int, default=0, help='Also list this number of top level packages '
+                                                                         'slowest to import.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    for name in args.service or list(SERVICES):
+        env = service_env(name, workdir)
+        subprocess.run([sys.executable, '-c', CREATE_TABLES_SCRIPT.format(package=SERVICES[name]['package'])],
+                       cwd=os.path.join(ROOT, f'{name}_service'), env=env, check=True, capture_output=True)
+        result = {'service': name, **measure_import(name, env, args.importtime)}
+        for mode in ('plain', 'launcher'):
+            result[mode] = measure_first_response(name, env, mode, args.workers, args.requests)
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
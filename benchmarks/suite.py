@@ -0,0 +1,450 @@
+"""
+Load and benchmark suite of auth_service and video_service.
+
+Both services run in this process against SQLite (or --auth-db-url / --video-db-url), driven by a weighted
+mix of requests at a fixed concurrency. Results are saved as JSON so runs can be compared:
+
+    python benchmarks/suite.py run --duration 30 --concurrency 16 --output benchmarks/results/base.json
+    python benchmarks/suite.py run --stub-auth --mix search=70,create=30 --output benchmarks/results/new.json
+    python benchmarks/suite.py compare benchmarks/results/base.json benchmarks/results/new.json
+
+With --stub-auth auth_service is replaced by a stub that accepts every token after --auth-latency seconds,
+so video_service is measured alone. Config of either app can be overridden with --set auth.KEY=VALUE or
+--set video.KEY=VALUE, VALUE is parsed as json when possible.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'auth_service'), os.path.join(ROOT, 'video_service')]
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+AUTH_PORT = 5012  # see VALIDATE_TOKEN_URL of video_service
+PASSWORD = 'bench1234'
+WORDS = ['music', 'live', 'official', 'video', 'remix', 'cover', 'tutorial', 'python', 'flask', 'game',
+         'review', 'trailer', 'news', 'football', 'highlight', 'travel', 'food', 'vlog', 'funny', 'cat']
+DEFAULT_MIX = 'validate=35,search=35,create=15,login=10,signup=5'
+AUTH_OPERATIONS = {'signup', 'login', 'validate'}
+AUTH_CONFIG = {
+    'DEBUG': False,
+    'JWT_GENERATE_KEYS': True,
+    'REVOCATION_BACKEND': 'local',
+    'TOKEN_PRUNE_SCHEDULER': False,
+    'PASSWORD_HASH_WORKERS': 0,
+}
+VIDEO_CONFIG = {
+    'DEBUG': False,
+    'SEARCH_BACKEND': 'memory',
+    'SEARCH_CACHE_BACKEND': 'local',
+}
+
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    """
+    Accept every token after a fixed latency
+    """
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    body = json.dumps({'code': 200, 'data': None, 'message': {'text': 'Token valid', 'status': 'success'}}).encode()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_json(self.body)
+
+    def do_POST(self):
+        # validate tokens batch api, every token is valid
+        tokens = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}').get('tokens', [])
+        time.sleep(self.latency)
+        results = [{'status': 'valid', 'identity': 'stub', 'expires_in': 3600} for _ in tokens]
+        self.send_json(json.dumps({'code': 200, 'data': {'tokens': results},
+                                   'message': {'text': 'OK', 'status': 'success'}}).encode())
+
+    def send_json(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def stub_token() -> str:
+    # shaped like a JWT, video_service does not send other tokens to auth_service
+    return f'stub.{uuid.uuid4().hex}.stub'
+
+
+def parse_value(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f'Unknown operations in mix: {", ".join(sorted(unknown))}')
+    return weights
+
+
+def make_config(base, overrides: dict):
+    return type(base.__name__, (base,), overrides)
+
+
+def serve(app, port: int):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Services(object):
+    """
+    auth_service (or its stub) and video_service served over HTTP from this process
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='benchmark-')
+        self.servers = []
+        self.auth_config = dict(AUTH_CONFIG, JWT_KEYS_DIR=os.path.join(self.workdir, 'keys'),
+                                SQLALCHEMY_DATABASE_URI=args.auth_db_url or
+                                f'sqlite:///{os.path.join(self.workdir, "auth.db")}')
+        if args.verify_mode == 'local':
+            # local verify reads revoked tokens from the redis revocation set of auth_service
+            self.auth_config['REVOCATION_BACKEND'] = 'redis'
+        self.video_config = dict(VIDEO_CONFIG, AUTH_VERIFY_MODE='remote' if args.stub_auth else args.verify_mode,
+                                 SQLALCHEMY_DATABASE_URI=args.video_db_url or
+                                 f'sqlite:///{os.path.join(self.workdir, "video.db")}')
+        for item in args.set:
+            key, _, value = item.partition('=')
+            service, _, name = key.partition('.')
+            {'auth': self.auth_config, 'video': self.video_config}[service][name] = parse_value(value)
+        self.video_url = f'http://127.0.0.1:{args.video_port}/api/v1/videos'
+        self.auth_url = f'http://127.0.0.1:{AUTH_PORT}/api/v1/auth'
+
+    def start(self) -> None:
+        # both apps write logs/ in current directory
+        os.chdir(self.workdir)
+        if self.args.stub_auth:
+            StubAuthHandler.latency = self.args.auth_latency
+            server = ThreadingHTTPServer(('127.0.0.1', AUTH_PORT), StubAuthHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        else:
+            from auth_app.app import create_app as create_auth_app
+            from auth_app.extensions import db as auth_db
+            from auth_app.settings import StgConfig as AuthConfig
+            auth_app = create_auth_app(make_config(AuthConfig, self.auth_config))
+            with auth_app.app_context():
+                auth_db.create_all()
+            self.servers.append(serve(auth_app, AUTH_PORT))
+
+        from video_app.app import create_app as create_video_app
+        from video_app.extensions import db as video_db
+        from video_app.settings import StgConfig as VideoConfig
+        video_app = create_video_app(make_config(VideoConfig, self.video_config))
+        with video_app.app_context():
+            video_db.create_all()
+        self.servers.append(serve(video_app, self.args.video_port))
+
+    def stop(self) -> None:
+        for server in self.servers:
+            server.shutdown()
+
+
+class Client(object):
+    """
+    One simulated user per thread: own session, own random generator seeded from --seed
+    """
+
+    def __init__(self, services: Services, tokens: list, seed: int):
+        self.services = services
+        self.tokens = tokens
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        self.prefix = f'bench-{seed}-{uuid.uuid4().hex[:6]}'
+        self.count = 0
+
+    def headers(self) -> dict:
+        token = self.random.choice(self.tokens) if self.tokens else stub_token()
+        return {'Authorization': f'Bearer {token}'}
+
+    def signup(self):
+        self.count += 1
+        return self.session.post(f'{self.services.auth_url}/signup',
+                                 json={'email': f'{self.prefix}-{self.count}@example.com', 'password': PASSWORD})
+
+    def login(self):
+        email = f'seed-{self.random.randrange(self.services.args.users)}@example.com'
+        return self.session.post(f'{self.services.auth_url}/login', json={'email': email, 'password': PASSWORD})
+
+    def validate(self):
+        return self.session.get(f'{self.services.auth_url}/tokens/validate', headers=self.headers())
+
+    def search(self):
+        keyword = ' '.join(self.random.sample(WORDS, self.random.choice([1, 1, 2])))
+        return self.session.get(self.services.video_url, params={'keyword': keyword, 'limit': 20})
+
+    def create(self):
+        title = ' '.join(self.random.sample(WORDS, 4))
+        return self.session.post(self.services.video_url, json={'title': title}, headers=self.headers())
+
+
+OPERATIONS = {
+    'signup': Client.signup,
+    'login': Client.login,
+    'validate': Client.validate,
+    'search': Client.search,
+    'create': Client.create,
+}
+
+
+def is_success(response) -> bool:
+    if response.status_code != 200:
+        return False
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        return response.json()['message']['status'] == 'success'
+    return True
+
+
+def seed(services: Services, args) -> list:
+    """
+    Create users and videos, return access tokens of users
+    """
+
+    tokens = []
+    if not args.stub_auth:
+        session = requests.Session()
+        for n in range(args.users):
+            email = f'seed-{n}@example.com'
+            session.post(f'{services.auth_url}/signup', json={'email': email, 'password': PASSWORD})
+            data = session.post(f'{services.auth_url}/login', json={'email': email, 'password': PASSWORD}).json()
+            tokens.append(data['data']['access_token'])
+
+    generator = random.Random(args.seed)
+    body = '\n'.join(json.dumps({'title': ' '.join(generator.sample(WORDS, 4))}) for _ in range(args.videos))
+    headers = {'Authorization': f'Bearer {tokens[0] if tokens else stub_token()}',
+               'Content-Type': 'application/x-ndjson'}
+    response = requests.post(f'{services.video_url}/bulk', data=body.encode(), headers=headers)
+    summary = json.loads(response.text.splitlines()[-1])['summary']
+    if summary['failed']:
+        raise SystemExit(f'Seed videos failed: {summary}')
+    return tokens
+
+
+def percentile(values: list, rank: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * rank))] if values else 0
+
+
+def drive(services: Services, tokens: list, weights: dict, args) -> dict:
+    """
+    Run the mix with args.concurrency threads for args.duration seconds or args.requests requests
+    :return: per operation: list of (latency, success)
+    """
+
+    names = list(weights)
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    remaining = [args.requests]
+    deadline = time.perf_counter() + args.duration
+
+    def worker(n):
+        client = Client(services, tokens, args.seed * 1000 + n)
+        local = {name: [] for name in names}
+        while time.perf_counter() < deadline:
+            if args.requests:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+            name = client.random.choices(names, [weights[name] for name in names])[0]
+            start = time.perf_counter()
+            try:
+                success = is_success(OPERATIONS[name](client))
+            except requests.RequestException:
+                success = False
+            local[name].append((time.perf_counter() - start, success))
+        with lock:
+            for name in names:
+                samples[name] += local[name]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples: dict, duration: float) -> dict:
+    results = {}
+    for name, values in samples.items():
+        latencies = sorted(latency for latency, _ in values)
+        results[name] = {
+            'requests': len(values),
+            'errors': sum(1 for _, success in values if not success),
+            'throughput': round(len(values) / duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    total = sum(len(values) for values in samples.values())
+    results['total'] = {
+        'requests': total,
+        'errors': sum(result['errors'] for result in results.values()),
+        'throughput': round(total / duration, 2),
+    }
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> None:
+    weights = parse_mix(args.mix)
+    if args.stub_auth:
+        weights = {name: weight for name, weight in weights.items() if name not in AUTH_OPERATIONS}
+        if not weights:
+            raise SystemExit('Stub auth mode only runs search and create')
+    output = os.path.abspath(args.output) if args.output else None
+
+    services = Services(args)
+    services.start()
+    try:
+        tokens = seed(services, args)
+        print(f'Seeded {len(tokens)} users and {args.videos} videos, running {args.duration}s '
+              f'at concurrency {args.concurrency}', file=sys.stderr)
+        samples, duration = drive(services, tokens, weights, args)
+    finally:
+        services.stop()
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key != 'func'},
+            'mix': weights,
+            'auth_config': services.auth_config if not args.stub_auth else None,
+            'video_config': services.video_config,
+            'duration': round(duration, 3),
+        },
+        'results': summarize(samples, duration),
+    }
+    print_results(report['results'])
+    if output:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f'Saved {output}', file=sys.stderr)
+
+
+def print_results(results: dict) -> None:
+    print(f'{"operation":<10} {"requests":>9} {"errors":>7} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for name, result in results.items():
+        print(f'{name:<10} {result["requests"]:>9} {result["errors"]:>7} {result["throughput"]:>9.1f} '
+              f'{result.get("p50_ms", ""):>9} {result.get("p95_ms", ""):>9} {result.get("p99_ms", ""):>9}')
+
+
+def compare(args) -> None:
+    """
+    Flag operations whose throughput dropped or p95 latency grew by more than --threshold, exit 1 if any
+    """
+
+    with open(args.base) as f:
+        base = json.load(f)['results']
+    with open(args.new) as f:
+        new = json.load(f)['results']
+
+    def change(old, value):
+        return (value - old) / old if old else 0
+
+    regressions = 0
+    print(f'{"operation":<10} {"req/s":>19} {"change":>8} {"p95 ms":>19} {"change":>8}')
+    for name in [name for name in base if name in new]:
+        throughput_change = change(base[name]['throughput'], new[name]['throughput'])
+        p95_change = change(base[name].get('p95_ms', 0), new[name].get('p95_ms', 0))
+        error_rate = new[name]['errors'] / new[name]['requests'] if new[name]['requests'] else 0
+        flags = []
+        if throughput_change < -args.threshold:
+            flags.append('throughput')
+        if p95_change > args.threshold:
+            flags.append('p95')
+        if error_rate > base[name]['errors'] / max(1, base[name]['requests']) + 0.01:
+            flags.append('errors')
+        regressions += bool(flags)
+        print(f'{name:<10} {base[name]["throughput"]:>9.1f} -> {new[name]["throughput"]:<7.1f} '
+              f'{throughput_change:>+8.1%} {base[name].get("p95_ms", 0):>9} -> {new[name].get("p95_ms", 0):<7} '
+              f'{p95_change:>+8.1%} {"REGRESSION: " + ", ".join(flags) if flags else ""}')
+    if regressions:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmark.')
+    run_parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Operation weights, default {DEFAULT_MIX}.')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--duration', type=float, default=20, help='Seconds.')
+    run_parser.add_argument('--requests', type=int, default=0, help='Stop after this number of requests.')
+    run_parser.add_argument('--users', type=int, default=10, help='Users created before the run.')
+    run_parser.add_argument('--videos', type=int, default=10000, help='Videos created before the run.')
+    run_parser.add_argument('--seed', type=int, default=1, help='Seed of random titles, keywords and users.')
+    run_parser.add_argument('--stub-auth', action='store_true', help='Replace auth_service by a stub.')
+    run_parser.add_argument('--auth-latency', type=float, default=0.01, help='Seconds per stub validate.')
+    run_parser.add_argument('--verify-mode', default='remote', choices=['local', 'remote'],
+                            help='AUTH_VERIFY_MODE of video_service with real auth_service, local needs redis '
+                                 'at REDIS_URL for revoked tokens.')
+    run_parser.add_argument('--auth-db-url', help='Default: SQLite in a temporary directory.')
+    run_parser.add_argument('--video-db-url', help='Default: SQLite in a temporary directory.')
+    run_parser.add_argument('--video-port', type=int, default=5013)
+    run_parser.add_argument('--set', action='append', default=[], metavar='SERVICE.KEY=VALUE',
+                            help='Override app config, can be repeated.')
+    run_parser.add_argument('--output', help='Save results as json.')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two saved runs.')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='Allowed change, default 10%%.')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+from gevent import monkey
+
+monkey.patch_all()  # noqa: must run before anything opens sockets or creates locks
+
+from video_app.api.helper import CONFIG  # noqa: E402
+from video_app.app import create_app  # noqa: E402
+
+
+class GeventConfig(CONFIG):
+    """
+    Same app served by greenlets: a request waiting on auth_service or the database yields to the others,
+    so one process serves thousands of concurrent requests. Blocking C drivers are swapped for pure python ones.
+    """
+
+    SQLALCHEMY_DATABASE_URI = CONFIG.SQLALCHEMY_DATABASE_URI.replace(
+        'mysql://', f'mysql+{CONFIG.GEVENT_DB_DRIVER}://', 1)
+    SQLALCHEMY_REPLICA_URIS = [uri.replace('mysql://', f'mysql+{CONFIG.GEVENT_DB_DRIVER}://', 1)
+                               for uri in CONFIG.SQLALCHEMY_REPLICA_URIS]
+    DATABASE_POOL_SIZE = CONFIG.GEVENT_DB_POOL_SIZE
+    DATABASE_MAX_OVERFLOW = CONFIG.GEVENT_DB_MAX_OVERFLOW
+    AUTH_CLIENT_POOL_SIZE = CONFIG.GEVENT_AUTH_CLIENT_POOL_SIZE
+
+
+app = create_app(GeventConfig)
+if __name__ == '__main__':
+    """
+    Video Application in gevent mode
+    python gevent_server.py
+    gunicorn -k gevent --worker-connections 1000 gevent_server:app
+    """
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(('0.0.0.0', 5013), app).serve_forever()
@@ -0,0 +1,33 @@
+"""
+gunicorn settings of video_service, from SERVER_* config
+
+    gunicorn -c gunicorn.conf.py
+
+The app is loaded and warmed up once in the master, workers are forked from it and share its memory
+copy-on-write. Each worker opens SERVER_WARMUP_CONNECTIONS database connections before it accepts requests.
+With SERVER_WORKER_CLASS=gevent the app of gevent_server.py is served, it patches the standard library
+when the master loads it.
+"""
+import gc
+import os
+from video_app.settings import CONFIG
+
+worker_class = CONFIG.SERVER_WORKER_CLASS
+wsgi_app = 'gevent_server:app' if worker_class == 'gevent' else 'server:app'
+bind = CONFIG.SERVER_BIND
+workers = CONFIG.SERVER_WORKERS or os.cpu_count() * 2 + 1
+threads = CONFIG.SERVER_THREADS
+timeout = CONFIG.SERVER_TIMEOUT
+preload_app = True
+
+
+def when_ready(server):
+    from video_app.warmup import warm_up
+    warm_up(server.app.wsgi())
+    # objects loaded so far live as long as the process, keep gc from touching (and copying) their pages in workers
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    from video_app.extensions import db
+    db.warm_pool(CONFIG.SERVER_WARMUP_CONNECTIONS, worker.wsgi)
@@ -0,0 +1,157 @@
+"""
+Load test of authorised video writes, sync workers against gevent workers, with a stubbed auth_service.
+
+    python loadtest.py --requests 2000 --concurrency 500 --auth-latency 0.05
+
+Every request carries its own token, so each one waits on a validate call to the stub. Needs gunicorn and
+gevent, uses a SQLite database unless DATABASE_URL is set.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from requests.adapters import HTTPAdapter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+AUTH_PORT = 5012  # see VALIDATE_TOKEN_URL
+VIDEO_PORT = 5113
+MODES = {
+    'sync': ['server:app', '--threads', '{threads}'],
+    'gevent': ['gevent_server:app', '-k', 'gevent', '--worker-connections', '{connections}'],
+}
+
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    """
+    Accept every token after a fixed latency
+    """
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.05
+    body = json.dumps({'code': 200, 'data': None, 'message': {'text': 'Token valid', 'status': 'success'}}).encode()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_json(self.body)
+
+    def do_POST(self):
+        # validate tokens batch api, every token is valid
+        tokens = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}').get('tokens', [])
+        time.sleep(self.latency)
+        results = [{'status': 'valid', 'identity': 'stub', 'expires_in': 3600} for _ in tokens]
+        self.send_json(json.dumps({'code': 200, 'data': {'tokens': results},
+                                   'message': {'text': 'OK', 'status': 'success'}}).encode())
+
+    def send_json(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_stub_auth(latency: float) -> None:
+    StubAuthHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', AUTH_PORT), StubAuthHandler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def wait_for(url: str, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def run_mode(mode: str, args, env: dict) -> dict:
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{VIDEO_PORT}']
+    command += [part.format(threads=args.threads, connections=args.concurrency * 2) for part in MODES[mode]]
+    server = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{VIDEO_PORT}/api/v1/videos'
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=args.concurrency))
+
+    def create_video(n):
+        start = time.perf_counter()
+        try:
+            # shaped like a JWT, video_service does not send other tokens to auth_service
+            res = session.post(url, json={'title': f'load test video {n}'}, timeout=60,
+                               headers={'Authorization': f'Bearer loadtest.{uuid.uuid4().hex}.stub'})
+            ok = res.status_code == 200 and res.json()['message']['status'] == 'success'
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    try:
+        wait_for(url)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(create_video, range(args.requests)))
+        duration = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'mode': mode,
+        'requests': len(results),
+        'errors': sum(1 for ok, _ in results if not ok),
+        'requests_per_second': round(len(results) / duration, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', action='append', choices=list(MODES), help='Default: all modes.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500, help='Requests in flight.')
+    parser.add_argument('--auth-latency', type=float, default=0.05, help='Seconds the stub takes per validate.')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes.')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per sync worker.')
+    parser.add_argument('--stub-auth', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.stub_auth:
+        return serve_stub_auth(args.auth_latency)
+
+    env = dict(os.environ, AUTH_VERIFY_MODE='remote', SEARCH_BACKEND='like', SEARCH_CACHE_BACKEND='local')
+    if 'DATABASE_URL' not in env:
+        database = os.path.join(HERE, 'loadtest.db')
+        if os.path.exists(database):
+            os.remove(database)
+        env['DATABASE_URL'] = 'sqlite:///' + database
+    os.environ.update(env)
+    from video_app.app import create_app
+    from video_app.extensions import db
+    with create_app().app_context():
+        db.create_all()
+
+    stub = subprocess.Popen([sys.executable, __file__, '--stub-auth', '--auth-latency', str(args.auth_latency)])
+    try:
+        wait_for(f'http://127.0.0.1:{AUTH_PORT}/')
+        for mode in args.mode or list(MODES):
+            print(json.dumps(run_mode(mode, args, env)))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+from video_app.app import create_app
+from video_app.settings import ProdConfig, StgConfig
+
+
+def test_create_app_prod():
+    app = create_app(ProdConfig)
+    assert app.config['ENV'] == 'prd'
+
+
+def test_create_app_stg():
+    app = create_app(StgConfig)
+    assert app.config['ENV'] == 'stg'
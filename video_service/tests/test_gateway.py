@@ -0,0 +1,76 @@
+import time
+import uuid
+import jwt
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from redis import RedisError
+from video_app import gateway
+from video_app.app import create_app
+from video_app.enums import REVOCATION_KEY_PREFIX
+from video_app.gateway import check_authorization, key_set, token_cache
+from video_app.settings import StgConfig
+
+
+class FakeRedis(object):
+    """
+    Revocation set of auth_service
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.error = None
+
+    def exists(self, key: str) -> int:
+        if self.error:
+            raise self.error
+        return int(key in self.keys)
+
+
+@pytest.fixture
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, private_key):
+    class TestConfig(StgConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "video.db"}'
+        AUTH_VERIFY_MODE = 'local'
+        AUTH_BATCH_WINDOW = 0
+        AUTH_CACHE_REVOCATION_SYNC_INTERVAL = 0
+
+    app = create_app(TestConfig)
+    monkeypatch.setattr(key_set, '_keys', {'test': private_key.public_key()})
+    monkeypatch.setattr(key_set, '_fetched_at', time.monotonic())
+    monkeypatch.setattr(gateway, 'redis', FakeRedis())
+    token_cache.clear()
+    return app
+
+
+def make_authorization(private_key, jti: str) -> str:
+    claims = {'jti': jti, 'type': 'access', 'identity': 'user', 'exp': int(time.time()) + 600}
+    token = jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': 'test'}).decode()
+    return f'Bearer {token}'
+
+
+def test_revoked_token_is_rejected_locally(app, private_key):
+    jti = str(uuid.uuid4())
+    authorization = make_authorization(private_key, jti)
+    with app.app_context():
+        assert check_authorization(authorization)
+
+        gateway.redis.keys.add(REVOCATION_KEY_PREFIX + jti)
+        # cached result is purged by revocation feed
+        token_cache.purge(jti=jti)
+        assert not check_authorization(authorization)
+
+
+def test_auth_service_checks_token_when_redis_is_down(app, private_key, monkeypatch):
+    checked = []
+    monkeypatch.setattr(gateway, 'verify_token_remotely', lambda authorization: checked.append(authorization))
+    gateway.redis.error = RedisError('Connection refused')
+    authorization = make_authorization(private_key, str(uuid.uuid4()))
+    with app.app_context():
+        assert not check_authorization(authorization)
+    assert checked == [authorization]
@@ -0,0 +1,28 @@
+import pytest
+from video_app.app import create_app
+from video_app.commands import insert_random_videos
+from video_app.extensions import db
+from video_app.search import listing_query_plans
+from video_app.settings import StgConfig
+from video_app.utils import get_timestamp_now
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(StgConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "video.db"}'
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        # plans of a nearly empty table may differ from production
+        insert_random_videos(5000)
+    return app
+
+
+def test_listing_queries_use_index_scans(app):
+    with app.app_context():
+        plans = listing_query_plans(get_timestamp_now())
+    failures = [plan for plan in plans if not plan['is_ok']]
+    assert len(plans) == 192
+    assert not failures, failures
@@ -1,12 +1,13 @@
-import os
-from flask import jsonify
-from video_app.settings import ProdConfig, StgConfig
+from datetime import datetime
+from flask import jsonify, current_app, request
+from video_app.metrics import metrics
+from video_app.settings import CONFIG  # noqa: F401
 
-CONFIG = ProdConfig if os.environ.get('ENV') == 'prd' else StgConfig
+DATA_PLACEHOLDER = '\x00data\x00'
 
 
 def send_result(data: any = None, message: str = "OK", code: int = 200,
-                status: str = 'success', show: bool = False, duration: int = 0):
+                status: str = 'success', show: bool = False, duration: int = 0, next_cursor: str = None):
     """
     Args:
     :param data: whatever you want
@@ -15,6 +16,7 @@ def send_result(data: any = None, message: str = "OK", code: int = 200,
     :param status: error
     :param show: show popup or not (useful for Frontend team)
     :param duration: show popup for duration second
+    :param next_cursor: cursor of next page for paginated list, omitted on last page
     :return:
     """
     message_dict = {
@@ -28,8 +30,12 @@ def send_result(data: any = None, message: str = "OK", code: int = 200,
         "data": data,
         "message": message_dict,
     }
+    if next_cursor is not None:
+        res["next_cursor"] = next_cursor
 
-    return jsonify(res), 200
+    with metrics.timed('serialize'):
+        response = jsonify(res)
+    return response, 200
 
 
 def send_error(data: any = None, message: str = "Error", code: int = 200,
@@ -56,6 +62,116 @@ def send_error(data: any = None, message: str = "Error", code: int = 200,
         "message": message_dict,
     }
 
-    return jsonify(res), code
+    with metrics.timed('serialize'):
+        response = jsonify(res)
+    return response, code
 
 
+def send_list_result(items: any, dump_item: any, message: str = "OK", code: int = 200, status: str = 'success',
+                     show: bool = False, duration: int = 0, next_cursor: str = None):
+    """
+    Same body as send_result(data=[dump_item(item) for item in items]), but each item is converted and
+    encoded in one pass, without building the whole data list first.
+    Args:
+    :param items: iterable of items, e.g. query rows
+    :param dump_item: convert an item to json serializable dict
+    :param message: error message
+    :param code: 200 is success
+    :param status: error
+    :param show: show popup or not (useful for Frontend team)
+    :param duration: show popup for duration second
+    :param next_cursor: cursor of next page for paginated list, omitted on last page
+    :return:
+    """
+    message_dict = {
+        "text": message,
+        "status": status,
+        "show": show,
+        "duration": duration,
+    }
+    res = {
+        "code": code,
+        "data": [DATA_PLACEHOLDER, DATA_PLACEHOLDER],
+        "message": message_dict,
+    }
+    if next_cursor is not None:
+        res["next_cursor"] = next_cursor
+
+    # same format as jsonify
+    indent = None
+    separators = (",", ":")
+    if current_app.config["JSONIFY_PRETTYPRINT_REGULAR"] or current_app.debug:
+        indent = 2
+        separators = (", ", ": ")
+
+    # one encoder for all items, flask.json.dumps resolves its options on every call
+    encoder = current_app.json_encoder(ensure_ascii=current_app.config["JSON_AS_ASCII"],
+                                       sort_keys=current_app.config["JSON_SORT_KEYS"],
+                                       indent=indent, separators=separators)
+
+    # envelope around data, and separator between items at data nesting level
+    head, item_separator, tail = encoder.encode(res).split(encoder.encode(DATA_PLACEHOLDER))
+    item_newline = head[head.rfind('\n'):] if indent else None
+    res["data"] = []
+    empty_body = encoder.encode(res)
+
+    with metrics.timed('serialize'):
+        parts = []
+        for item in items:
+            item_json = encoder.encode(dump_item(item))
+            if item_newline:
+                item_json = item_json.replace('\n', item_newline)
+            parts.append(item_separator if parts else head)
+            parts.append(item_json)
+        parts.append(tail if parts else empty_body)
+        parts.append("\n")
+        body = ''.join(parts)
+    return current_app.response_class(body, mimetype=current_app.config["JSONIFY_MIMETYPE"]), 200
+
+
+def send_raw_result(body: bytes):
+    """
+    Response from a body built before by send_result or send_list_result, e.g. cached
+    :param body:
+    :return:
+    """
+    return current_app.response_class(body, mimetype=current_app.config["JSONIFY_MIMETYPE"]), 200
+
+
+def is_not_modified(etag: str, last_modified: datetime = None) -> bool:
+    """
+    Client copy is still valid: If-None-Match has etag or, without If-None-Match, nothing changed since If-Modified-Since
+    :param etag: current weak etag of the resource, without quotes
+    :param last_modified: current modification time, None if unknown
+    :return:
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def set_validators(response, etag: str, last_modified: datetime = None):
+    """
+    Add ETag and Last-Modified to response, caches may store it but must revalidate before each reuse
+    :param response:
+    :param etag: weak etag, same for every encoding of the body
+    :param last_modified:
+    :return: response
+    """
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def send_not_modified(etag: str, last_modified: datetime = None):
+    """
+    Empty 304 response with same validators as the full response
+    :param etag:
+    :param last_modified:
+    :return:
+    """
+    return set_validators(current_app.response_class(status=304), etag, last_modified), 304
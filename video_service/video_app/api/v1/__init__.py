@@ -1 +1,2 @@
 from video_app.api.v1 import video
+from video_app.api.v1 import stats
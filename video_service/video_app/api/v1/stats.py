@@ -0,0 +1,39 @@
+from flask import Blueprint
+from video_app.api.helper import send_result
+from video_app.extensions import auth_client, log_handler
+from video_app.gateway import token_cache, token_batcher, revocation_feed
+from video_app.cache import search_cache
+from video_app.coalesce import query_coalescer
+from video_app.compression import compressor
+
+api = Blueprint('stats', __name__)
+
+
+@api.route('', methods=['GET'])
+def get_stats():
+    """
+    Runtime counters of current worker
+    Returns:
+            {
+                "log": queued, dropped and sampled out log records,
+                "auth_client": counters of auth_service http client,
+                "token_cache": counters of token validation cache,
+                "revocation_feed": reads of auth_service revocation log purging token cache,
+                "token_batcher": remote token checks and batches they were sent in,
+                "search_cache": counters of search result cache,
+                "search_coalescer": searches, shared queries and coalesced_ratio of searches that did not run one,
+                "compression": compressed responses and bytes before and after
+            }
+    """
+
+    data = {
+        'log': log_handler.stats(),
+        'auth_client': auth_client.stats(),
+        'token_cache': token_cache.stats(),
+        'revocation_feed': revocation_feed.stats(),
+        'token_batcher': token_batcher.stats(),
+        'search_cache': search_cache.stats(),
+        'search_coalescer': query_coalescer.stats(),
+        'compression': compressor.stats(),
+    }
+    return send_result(data=data)
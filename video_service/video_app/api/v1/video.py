@@ -1,13 +1,21 @@
 import json
-import uuid
+from contextlib import nullcontext
+from datetime import datetime, timezone
 
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, current_app, stream_with_context
 from video_app.utils import logged_input, get_timestamp_now
-from video_app.validator import CreateVideoSchema, VideoSchema
+from video_app.validator import create_video_validator, search_video_validator, dump_video, parse_bool
 from video_app.models import Video
-from video_app.api.helper import send_error, send_result
+from video_app.api.helper import (send_error, send_result, send_list_result, send_raw_result, is_not_modified,
+                                 send_not_modified, set_validators)
 from video_app.extensions import db
+from video_app.ids import new_id
 from video_app.gateway import authorization_require
+from video_app.search import search_engine
+from video_app.cache import search_cache
+from video_app.coalesce import query_coalescer, CoalesceTimeout
+from video_app.ingest import iter_ndjson, iter_json_array, ingest_videos
+from video_app.metrics import metrics
 
 api = Blueprint('videos', __name__)
 
@@ -18,14 +26,78 @@ def search_videos():
     Search video api
     Requests params:
             keyword: string, optional
+            limit: integer, optional, page size, at most SEARCH_MAX_PAGE_SIZE
+            cursor: string, optional, next_cursor of previous page
+            order: string, optional, desc (newest first, default) or asc
+            sort: string, optional, created_date (default) or modified_date, after relevance with a keyword
+            is_deleted: boolean, optional, default false
+            is_active: boolean, optional, active and inactive videos if not set
+            created_from, created_to: integer, optional, created date range in timestamp, inclusive
+    Requests Header:
+            If-None-Match, If-Modified-Since: optional, validators of a previous response
     Returns:
-            list videos
+            list videos, most relevant first, next_cursor if there is a next page,
+            or 304 without body if no video was added since the previous response
     """
 
+    with metrics.timed('validate'):
+        _, is_not_validate = search_video_validator.validate(request.args)  # Dictionary show detail error fields
+    if is_not_validate:
+        return send_error(data=is_not_validate, message='Invalid params')
+
     keyword = request.args.get('keyword', '').strip()
-    videos = Video.query.filter(Video.title.ilike(f'%{keyword}%')).all()
-    videos_dumped = VideoSchema(many=True).dumps(videos)
-    return send_result(data=json.loads(videos_dumped))
+    limit = min(request.args.get('limit', current_app.config['SEARCH_DEFAULT_PAGE_SIZE'], type=int),
+                current_app.config['SEARCH_MAX_PAGE_SIZE'])
+    cursor = request.args.get('cursor')
+    descending = request.args.get('order', 'desc') == 'desc'
+    sort = request.args.get('sort', 'created_date')
+    filters = {
+        'is_deleted': request.args.get('is_deleted', False, type=parse_bool),
+        'is_active': request.args.get('is_active', type=parse_bool),
+        'created_from': request.args.get('created_from', type=int),
+        'created_to': request.args.get('created_to', type=int),
+    }
+
+    cache_key = search_cache.make_key(search_engine.normalize(keyword), limit, cursor, descending, sort, filters)
+    cache_version, recently_written = search_cache.get_version()
+    # a replica may not have the write that bumped the version yet, what is read now is cached under it
+    replica = nullcontext if recently_written else db.replica
+
+    # any added video changes every listing, check it before running the search
+    with metrics.timed('validator'), replica():
+        newest, count = search_cache.get_validator(cache_version, Video.get_newest)
+    etag = f'{cache_version or 0}-{newest}-{count}'
+    # a video added later in the newest second would not change it
+    last_modified = datetime.fromtimestamp(newest, timezone.utc) if 0 < newest < get_timestamp_now() else None
+    if is_not_modified(etag, last_modified):
+        return send_not_modified(etag, last_modified)
+
+    with metrics.timed('cache'):
+        body = search_cache.get(cache_version, cache_key)
+    if body is not None:
+        response, status_code = send_raw_result(body)
+        return set_validators(response, etag, last_modified), status_code
+
+    def load():
+        # results may be a little behind the primary, like cached pages
+        with replica():
+            videos, next_cursor = search_engine.search(keyword, limit, cursor, descending, sort, filters)
+        response, _ = send_list_result(videos, dump_video, next_cursor=next_cursor)
+        body = response.get_data()
+        search_cache.set(cache_version, cache_key, body)
+        return body
+
+    try:
+        with metrics.timed('search'):
+            # identical searches arriving meanwhile wait for this one, in this worker or another
+            body = query_coalescer.run(f'{cache_version}:{cache_key}', load,
+                                       lambda: search_cache.get(cache_version, cache_key, count=False))
+    except ValueError:
+        return send_error(data={'cursor': ['Invalid cursor.']}, message='Invalid params')
+    except CoalesceTimeout:
+        return send_error(message='Search is busy, please try again', code=503)
+    response, status_code = send_raw_result(body)
+    return set_validators(response, etag, last_modified), status_code
 
 
 @api.route('', methods=['POST'])
@@ -46,29 +118,53 @@ def create_new_video():
     except Exception as ex:
         return send_error(message='Request Body incorrect json format: ' + str(ex), code=442)
 
-    logged_input(json.dumps(json_req))
+    logged_input(json_req)
     if json_req is None:
         return send_error(message='Please check your json requests', code=442)
 
-    # trim input body
-    json_body = {}
-    for key, value in json_req.items():
-        json_body.setdefault(key, str(value).strip())
-
-    # validate request body
-    is_not_validate = CreateVideoSchema().validate(json_body)  # Dictionary show detail error fields
+    # trim and validate request body
+    with metrics.timed('validate'):
+        json_body, is_not_validate = create_video_validator.validate(json_req)  # Dictionary show detail error fields
     if is_not_validate:
         return send_error(data=is_not_validate, message='Invalid params')
 
     title = json_body.get('title')
     url = json_body.get('url', '')
     thumbnail_url = json_body.get('thumbnail_url', '')
-    _id = str(uuid.uuid4())
+    _id = new_id()
     # Store video to db
     new_video = Video(id=_id, title=title, url=url, thumbnail_url=thumbnail_url)
     db.session.add(new_video)
     db.session.commit()
+    search_engine.index_video(new_video)
+    search_cache.invalidate()
     data = {
         'video_id': _id
     }
     return send_result(data)
+
+
+@api.route('/bulk', methods=['POST'])
+@authorization_require()
+def bulk_create_videos():
+    """
+    Create many videos in one request, body is streamed so it can hold millions of videos.
+    Requests Body:
+            NDJSON (application/x-ndjson), one video per line, or a JSON array (application/json) of videos:
+            {"title": "This is the first video", "url": "https://video.com/123", "thumbnail_url": "..."}
+    Returns:
+            NDJSON streamed while videos are inserted, row is the 1-based position of the video in body:
+            {"row": 1, "video_id": "..."}
+            {"row": 2, "errors": {"title": ["Missing data for required field."]}}
+            ...
+            {"summary": {"inserted": 1, "failed": 1}}
+    """
+
+    max_row_size = current_app.config['VIDEO_BULK_MAX_ROW_SIZE']
+    if request.mimetype == 'application/json':
+        rows = iter_json_array(request.stream, max_row_size)
+    else:
+        rows = iter_ndjson(request.stream, max_row_size)
+    results = ingest_videos(rows, current_app.config['VIDEO_BULK_CHUNK_SIZE'])
+    body = (json.dumps(result, separators=(',', ':')) + '\n' for result in results)
+    return Response(stream_with_context(body), mimetype='application/x-ndjson')
@@ -2,7 +2,13 @@
 
 from flask import Flask
 from video_app.api.helper import CONFIG
-from video_app.extensions import db, migrate
+from video_app.metrics import metrics
+from video_app.extensions import db, migrate, redis, auth_client, log_handler
+from video_app.search import search_engine
+from video_app.cache import search_cache
+from video_app.coalesce import query_coalescer
+from video_app.compression import compressor
+from video_app.commands import search_cli, video_cli
 from .api import v1 as api_v1
 from video_app.models import Video  # Must have to migrate db
 
@@ -17,6 +23,7 @@ def create_app(config_object=CONFIG):
     app.config.from_object(config_object)
     register_extensions(app)
     register_blueprints(app)
+    register_commands(app)
     return app
 
 
@@ -27,9 +34,17 @@ def register_extensions(app):
     :return:
     """
 
+    log_handler.init_app(app)
+    metrics.init_app(app)
     db.app = app
     db.init_app(app)  # SQLAlchemy
     migrate.init_app(app, db)
+    redis.init_app(app)
+    auth_client.init_app(app)
+    search_engine.init_app(app)
+    search_cache.init_app(app)
+    query_coalescer.init_app(app)
+    compressor.init_app(app)
 
 
 def register_blueprints(app):
@@ -39,3 +54,14 @@ def register_blueprints(app):
     :return:
     """
     app.register_blueprint(api_v1.video.api, url_prefix='/api/v1/videos')
+    app.register_blueprint(api_v1.stats.api, url_prefix='/api/v1/stats')
+
+
+def register_commands(app):
+    """
+    Init flask cli commands
+    :param app:
+    :return:
+    """
+    app.cli.add_command(search_cli)
+    app.cli.add_command(video_cli)
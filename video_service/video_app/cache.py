@@ -0,0 +1,204 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from redis import RedisError
+from video_app.extensions import redis
+from video_app.utils import logged_error
+
+
+class LocalSearchCache(object):
+    """
+    Search results of current worker, LRU bounded by SEARCH_CACHE_SIZE, entries live SEARCH_CACHE_TTL.
+    The version is only bumped by writes of this worker, use redis backend with several workers.
+    """
+
+    name = 'local'
+
+    def __init__(self, max_size: int = 1000, ttl: float = 30, replica_lag: float = 5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.replica_lag = replica_lag
+        self._version = 0
+        self._written_at = float('-inf')
+        self._entries = OrderedDict()  # key -> (body, expires_at)
+        self._lock = threading.Lock()
+
+    def get_version(self) -> tuple:
+        return self._version, time.monotonic() - self._written_at < self.replica_lag
+
+    def get(self, version: int, key: str):
+        with self._lock:
+            entry = self._entries.get((version, key))
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[(version, key)]
+                return None
+            self._entries.move_to_end((version, key))
+            return entry[0]
+
+    def set(self, version: int, key: str, body: bytes) -> None:
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[(version, key)] = (body, time.monotonic() + self.ttl)
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._written_at = time.monotonic()
+            self._entries.clear()
+
+
+class RedisSearchCache(object):
+    """
+    Search results shared by all workers in redis.
+    Entries expire after SEARCH_CACHE_TTL, writes bump the version so old entries are never read again,
+    size is bounded by redis maxmemory with an lru eviction policy.
+    """
+
+    name = 'redis'
+    VERSION_KEY = 'video:search:version'
+    WRITTEN_KEY = 'video:search:written'  # set for SEARCH_CACHE_REPLICA_LAG seconds after each write
+
+    def __init__(self, ttl: float = 30, replica_lag: float = 5):
+        self.ttl = ttl
+        self.replica_lag = replica_lag
+
+    def get_version(self) -> tuple:
+        version, written = redis.mget(self.VERSION_KEY, self.WRITTEN_KEY)
+        return int(version or 0), written is not None
+
+    def get(self, version: int, key: str):
+        return redis.get(f'video:search:{version}:{key}')
+
+    def set(self, version: int, key: str, body: bytes) -> None:
+        redis.set(f'video:search:{version}:{key}', body, ex=int(self.ttl))
+
+    def invalidate(self) -> None:
+        # one transaction, a reader of the new version always sees the write marker
+        pipeline = redis.pipeline()
+        pipeline.incr(self.VERSION_KEY)
+        if self.replica_lag > 0:
+            pipeline.set(self.WRITTEN_KEY, 1, px=int(self.replica_lag * 1000))
+        pipeline.execute()
+
+
+class SearchCache(object):
+    """
+    Cache of search video response bodies, keyed on normalised keyword and paging params,
+    invalidated by version bump whenever videos are written.
+    """
+
+    VALIDATOR_KEY = 'validator'
+
+    def __init__(self):
+        self.backend = None
+        self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'errors': 0}
+
+    def init_app(self, app):
+        config = app.config
+        if config['SEARCH_CACHE_BACKEND'] == LocalSearchCache.name:
+            self.backend = LocalSearchCache(config['SEARCH_CACHE_SIZE'], config['SEARCH_CACHE_TTL'],
+                                            config['SEARCH_CACHE_REPLICA_LAG'])
+        elif config['SEARCH_CACHE_BACKEND'] == RedisSearchCache.name:
+            self.backend = RedisSearchCache(config['SEARCH_CACHE_TTL'], config['SEARCH_CACHE_REPLICA_LAG'])
+        else:
+            self.backend = None
+
+    @staticmethod
+    def make_key(keyword: str, limit: int, cursor: str, descending: bool, sort: str = 'created_date',
+                 filters: dict = None) -> str:
+        params = '\x00'.join([keyword, str(limit), cursor or '', 'desc' if descending else 'asc', sort,
+                              json.dumps(filters or {}, sort_keys=True)])
+        return hashlib.sha256(params.encode()).hexdigest()
+
+    def get_version(self) -> tuple:
+        """
+        Read version before running the query, so a write during the query makes the result unreachable.
+        Replicas may not have a write yet when the version is bumped, results cached under the new version
+        must be read from the primary for a while, or a page older than the write would be cached.
+        :return: (version, None if cache is disabled or unavailable;
+                  written less than SEARCH_CACHE_REPLICA_LAG seconds ago, read from primary then)
+        """
+
+        if self.backend is None:
+            return None, False
+        try:
+            return self.backend.get_version()
+        except RedisError as ex:
+            self.counters['errors'] += 1
+            logged_error(f"Read search cache version failed: {ex}")
+            return None, False
+
+    def get(self, version, key: str, count: bool = True):
+        """
+        :param version: from get_version
+        :param key: from make_key
+        :param count: count hit or miss, not when polling for the body of another worker
+        :return: body, None if not cached
+        """
+
+        if version is None:
+            return None
+        try:
+            body = self.backend.get(version, key)
+        except RedisError as ex:
+            self.counters['errors'] += 1
+            logged_error(f"Read search cache failed: {ex}")
+            return None
+        if count:
+            self.counters['hits' if body is not None else 'misses'] += 1
+        return body
+
+    def set(self, version, key: str, body: bytes) -> None:
+        if version is None:
+            return
+        try:
+            self.backend.set(version, key, body)
+        except RedisError as ex:
+            self.counters['errors'] += 1
+            logged_error(f"Write search cache failed: {ex}")
+
+    def get_validator(self, version, load) -> tuple:
+        """
+        Validator of the whole catalogue for conditional requests, cached under version like bodies so it is
+        never older than a cached body
+        :param version: from get_version
+        :param load: read (newest created_date, count) from database on a miss, e.g. Video.get_newest
+        :return: (newest, count)
+        """
+
+        cached = self.get(version, self.VALIDATOR_KEY)
+        if cached is not None:
+            newest, count = cached.split(b':')
+            return int(newest), int(count)
+        newest, count = load()
+        self.set(version, self.VALIDATOR_KEY, f'{newest}:{count}'.encode())
+        return newest, count
+
+    def invalidate(self) -> None:
+        """
+        Call after every committed write of videos
+        """
+
+        if self.backend is None:
+            return
+        try:
+            self.backend.invalidate()
+            self.counters['invalidations'] += 1
+        except RedisError as ex:
+            # entries of old version still expire after SEARCH_CACHE_TTL
+            self.counters['errors'] += 1
+            logged_error(f"Invalidate search cache failed: {ex}")
+
+    def stats(self) -> dict:
+        return dict(self.counters, backend=self.backend.name if self.backend else None)
+
+
+search_cache = SearchCache()
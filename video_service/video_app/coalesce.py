@@ -0,0 +1,219 @@
+import threading
+import time
+import uuid
+from redis import RedisError
+from video_app.extensions import redis
+from video_app.metrics import metrics
+from video_app.utils import logged_error
+
+
+class CoalesceTimeout(Exception):
+    pass
+
+
+class LocalQueryLock(object):
+    """
+    In process stand-in of the redis lock, only coalesces searches of current worker
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self._locks = {}  # name -> (token, expires_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, name: str, ttl: float):
+        with self._lock:
+            entry = self._locks.get(name)
+            if entry is not None and entry[1] > time.monotonic():
+                return None
+            token = uuid.uuid4().hex
+            self._locks[name] = (token, time.monotonic() + ttl)
+            return token
+
+    def release(self, name: str, token: str) -> None:
+        with self._lock:
+            entry = self._locks.get(name)
+            if entry is not None and entry[0] == token:
+                del self._locks[name]
+
+    def is_locked(self, name: str) -> bool:
+        entry = self._locks.get(name)
+        return entry is not None and entry[1] > time.monotonic()
+
+
+class RedisQueryLock(object):
+    """
+    Lock shared by all workers in redis, expires after SEARCH_COALESCE_LOCK_TTL if its holder dies
+    """
+
+    name = 'redis'
+    # delete the lock only if it is still ours, it may have expired and been taken by another worker
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self):
+        self._release = None  # registered on first use, redis is bound to the app once it is created
+
+    def acquire(self, name: str, ttl: float):
+        token = uuid.uuid4().hex
+        if redis.set(f'video:search:lock:{name}', token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+
+    def release(self, name: str, token: str) -> None:
+        if self._release is None:
+            self._release = redis.register_script(self.RELEASE_SCRIPT)
+        self._release(keys=[f'video:search:lock:{name}'], args=[token])
+
+    def is_locked(self, name: str) -> bool:
+        return bool(redis.exists(f'video:search:lock:{name}'))
+
+
+class Flight(object):
+    """
+    Search running in current worker, and its result once done
+    """
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class QueryCoalescer(object):
+    """
+    Coalesce concurrent identical searches, e.g. a trending keyword, into one query and one serialised body.
+
+    The first request of a key runs it, requests of the same key arriving meanwhile in the worker wait for its
+    result, or its exception. With SEARCH_COALESCE_LOCK_BACKEND the runner also holds a lock of the key, so a
+    worker finding it taken polls the result of the other worker instead, e.g. in the shared search cache, and
+    runs the search itself if the lock is released without a result. Waiting longer than SEARCH_COALESCE_TIMEOUT
+    raises CoalesceTimeout.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = None
+        self.timeout = 6
+        self.lock_ttl = 10
+        self.poll_interval = 0.01
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'queries': 0, 'coalesced': 0, 'shared': 0, 'timeouts': 0, 'errors': 0,
+                         'lock_errors': 0}
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['SEARCH_COALESCE_ENABLED']
+        self.timeout = config['SEARCH_COALESCE_TIMEOUT']
+        self.lock_ttl = config['SEARCH_COALESCE_LOCK_TTL']
+        self.poll_interval = config['SEARCH_COALESCE_POLL_INTERVAL']
+        if config['SEARCH_COALESCE_LOCK_BACKEND'] == LocalQueryLock.name:
+            self.lock = LocalQueryLock()
+        elif config['SEARCH_COALESCE_LOCK_BACKEND'] == RedisQueryLock.name:
+            self.lock = RedisQueryLock()
+        else:
+            self.lock = None
+
+    def run(self, key: str, load, lookup=None):
+        """
+        Result of load, shared with concurrent calls of the same key
+        :param key: identity of the search, e.g. cache version and key
+        :param load: run the search, its result is returned to every waiting call
+        :param lookup: read the result of another worker, None while it is not there, e.g. from search cache.
+        Workers only wait for each other with a lookup
+        :return: result of load, raise its exception or CoalesceTimeout
+        """
+
+        if not self.enabled:
+            return load()
+
+        with self._lock:
+            self.counters['requests'] += 1
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self.counters['coalesced'] += 1
+
+        if not is_leader:
+            with metrics.timed('coalesce'):
+                if not flight.done.wait(self.timeout):
+                    self.counters['timeouts'] += 1
+                    raise CoalesceTimeout('Search is still running')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._run_locked(key, load, lookup)
+        except Exception as ex:
+            flight.error = ex
+            raise
+        finally:
+            # later calls run a new search, then wake the waiting ones
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _run_locked(self, key: str, load, lookup):
+        if self.lock is None or lookup is None:
+            return self._load(load)
+        try:
+            token = self.lock.acquire(key, self.lock_ttl)
+        except RedisError as ex:
+            self.counters['lock_errors'] += 1
+            logged_error(f"Acquire search lock failed: {ex}")
+            return self._load(load)
+
+        if token is not None:
+            try:
+                return self._load(load)
+            finally:
+                try:
+                    self.lock.release(key, token)
+                except RedisError as ex:
+                    # expires after SEARCH_COALESCE_LOCK_TTL
+                    self.counters['lock_errors'] += 1
+                    logged_error(f"Release search lock failed: {ex}")
+
+        deadline = time.monotonic() + self.timeout
+        with metrics.timed('coalesce'):
+            while True:
+                time.sleep(self.poll_interval)
+                result = lookup()
+                if result is not None:
+                    self.counters['shared'] += 1
+                    return result
+                try:
+                    is_locked = self.lock.is_locked(key)
+                except RedisError as ex:
+                    self.counters['lock_errors'] += 1
+                    logged_error(f"Read search lock failed: {ex}")
+                    is_locked = False
+                if not is_locked:
+                    # failed, or its worker died
+                    break
+                if time.monotonic() >= deadline:
+                    self.counters['timeouts'] += 1
+                    raise CoalesceTimeout('Search is still running in another worker')
+        return self._load(load)
+
+    def _load(self, load):
+        self.counters['queries'] += 1
+        try:
+            return load()
+        except Exception:
+            self.counters['errors'] += 1
+            raise
+
+    def stats(self) -> dict:
+        requests = self.counters['requests']
+        ratio = round((self.counters['coalesced'] + self.counters['shared']) / (requests or 1), 4)
+        return dict(self.counters, coalesced_ratio=ratio, in_flight=len(self._flights),
+                    lock_backend=self.lock.name if self.lock else None)
+
+
+query_coalescer = QueryCoalescer()
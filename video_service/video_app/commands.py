@@ -0,0 +1,252 @@
+import json
+import random
+import tempfile
+import tracemalloc
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from video_app.api.helper import send_result, send_list_result
+from video_app.extensions import db
+from video_app.ids import new_id, migrate_table
+from video_app.gateway import token_cache
+from video_app.models import Video
+from video_app.search import (search_engine, listing_query_plans, LikeSearchBackend, FullTextSearchBackend,
+                              InMemorySearchBackend)
+from video_app.utils import get_timestamp_now
+from video_app.validator import (VideoSchema, CreateVideoSchema, SearchVideoSchema, dump_video, create_video_validator,
+                                 search_video_validator)
+
+search_cli = AppGroup('search', help='Video search index commands.')
+video_cli = AppGroup('videos', help='Video commands.')
+
+BENCHMARK_WORDS = ['music', 'live', 'official', 'video', 'remix', 'cover', 'tutorial', 'python', 'flask', 'game',
+                   'review', 'trailer', 'news', 'football', 'highlight', 'travel', 'food', 'vlog', 'funny', 'cat']
+
+
+def insert_random_videos(count: int) -> None:
+    """
+    Insert count videos with random titles from BENCHMARK_WORDS, some inactive, deleted or modified
+    """
+
+    now = get_timestamp_now()
+    for i in range(0, count, 1000):
+        db.session.bulk_insert_mappings(Video, [
+            {'id': new_id(), 'title': ' '.join(random.sample(BENCHMARK_WORDS, 4)), 'url': '',
+             'thumbnail_url': '', 'created_date': now - random.randrange(86400 * 365),
+             'modified_date': random.choice([0, now - random.randrange(86400 * 30)]),
+             'is_deleted': random.random() < 0.1, 'is_active': random.random() < 0.9}
+            for _ in range(min(1000, count - i))])
+        db.session.commit()
+
+
+@search_cli.command('rebuild')
+def rebuild_search_index():
+    """
+    Rebuild search index of current SEARCH_BACKEND
+    """
+
+    start = time.perf_counter()
+    total = search_engine.rebuild()
+    click.echo(f'Indexed {total} videos with "{search_engine.backend.name}" backend '
+               f'in {time.perf_counter() - start:.2f}s')
+
+
+@search_cli.command('benchmark')
+@click.option('--keyword', 'keywords', multiple=True, default=['music', 'python flask', 'zzz'],
+              help='Keyword to search, can be repeated.')
+@click.option('--repeat', default=20, help='Searches per keyword.')
+@click.option('--limit', default=20, help='Page size.')
+@click.option('--seed', default=0, help='Insert this number of random videos before running.')
+def benchmark_search(keywords, repeat, limit, seed):
+    """
+    Compare search backends with the ILIKE path on current database
+    """
+
+    if seed:
+        insert_random_videos(seed)
+        click.echo(f'Inserted {seed} videos')
+
+    backends = [LikeSearchBackend()]
+    if db.engine.dialect.name == 'mysql':
+        backends.append(FullTextSearchBackend())
+    if db.engine.dialect.name == 'sqlite':
+        memory_backend = InMemorySearchBackend()
+        start = time.perf_counter()
+        total = memory_backend.rebuild()
+        click.echo(f'memory: indexed {total} videos in {time.perf_counter() - start:.2f}s')
+        backends.append(memory_backend)
+
+    for keyword in keywords:
+        for backend in backends:
+            durations = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                videos = backend.search(keyword, limit)
+                durations.append(time.perf_counter() - start)
+                db.session.expunge_all()
+            durations.sort()
+            click.echo(f'{backend.name:<8} keyword="{keyword}" results={len(videos)} '
+                       f'mean={sum(durations) / len(durations) * 1000:.2f}ms '
+                       f'p95={durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000:.2f}ms')
+
+
+@search_cli.command('benchmark-serialize')
+@click.option('--rows', default=1000, help='Videos per response.')
+@click.option('--repeat', default=20, help='Responses per path.')
+def benchmark_serialize(rows, repeat):
+    """
+    CPU time of listing response body: VideoSchema dumps -> loads -> jsonify against send_list_result
+    """
+
+    now = get_timestamp_now()
+    videos = [Video(id=new_id(), title=' '.join(random.sample(BENCHMARK_WORDS, 4)),
+                    url='https://video.com/123', thumbnail_url='https://thumbnail.com/123',
+                    created_date=now, modified_date=0, is_deleted=False, is_active=True)
+              for _ in range(rows)]
+    paths = [
+        ('dumps-loads-jsonify', lambda: send_result(data=json.loads(VideoSchema(many=True).dumps(videos)))),
+        ('one-pass', lambda: send_list_result(videos, dump_video)),
+    ]
+
+    with current_app.test_request_context():
+        bodies = {name: fn()[0].get_data() for name, fn in paths}
+        click.echo(f'Bodies identical: {len(set(bodies.values())) == 1}')
+        for name, fn in paths:
+            start = time.process_time()
+            for _ in range(repeat):
+                fn()[0].get_data()
+            cpu_time = (time.process_time() - start) / repeat / rows * 1000
+            click.echo(f'{name:<20} {cpu_time * 1000:.2f}ms CPU per 1k videos')
+
+
+@video_cli.command('migrate-ids')
+@click.option('--batch-size', default=1000, help='Videos copied per transaction.')
+@click.option('--drop-old', is_flag=True, help='Drop video_old once videos are copied.')
+def migrate_video_ids(batch_size, drop_old):
+    """
+    Convert video table to a single column primary key of 16 bytes binary id, see ids.migrate_table.
+    Stop the service first. Ids keep their string form. Run flask search rebuild afterwards. Can be run again.
+    """
+
+    copied = migrate_table(db.engine, Video.__table__, ['id'], batch_size, drop_old, click.echo)
+    click.echo(f'Done: {copied} videos copied')
+
+
+@video_cli.command('benchmark-ingest')
+@click.option('--rows', default=100000, help='Videos sent to the bulk api.')
+@click.option('--single-rows', default=1000, help='Videos sent one by one to the create api.')
+@click.option('--trace-memory', is_flag=True, help='Report peak python memory of bulk api, slows it down.')
+def benchmark_ingest(rows, single_rows, trace_memory):
+    """
+    Videos per second of create video api against bulk api, auth is cached so only the api itself is measured
+    """
+
+    authorization = 'Bearer benchmark-ingest'
+    token_cache.set(token_cache.make_key(authorization), True, get_timestamp_now() + 3600)
+    headers = {'Authorization': authorization}
+    client = current_app.test_client()
+
+    start = time.perf_counter()
+    for n in range(single_rows):
+        client.post('/api/v1/videos', headers=headers, json={'title': f'benchmark single video {n}'})
+    single_rate = single_rows / (time.perf_counter() - start)
+    click.echo(f'single: {single_rows} videos, {single_rate:.0f} videos/s')
+
+    # body is written to a file and streamed, so neither side holds all videos in memory
+    with tempfile.TemporaryFile() as body:
+        for n in range(rows):
+            body.write(json.dumps({'title': f'benchmark bulk video {n}', 'url': 'https://video.com/123'}).encode())
+            body.write(b'\n')
+        size = body.tell()
+        body.seek(0)
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        response = client.post('/api/v1/videos/bulk', headers=headers, input_stream=body, content_length=size,
+                               content_type='application/x-ndjson', buffered=False)
+        summary = None
+        for line in response.response:
+            if line.startswith(b'{"summary"'):
+                summary = json.loads(line)['summary']
+        duration = time.perf_counter() - start
+    click.echo(f'bulk:   {rows} videos, {rows / duration:.0f} videos/s, {rows / duration / single_rate:.0f}x single, '
+               f'summary={summary}')
+    if trace_memory:
+        click.echo(f'bulk:   peak python memory {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f}MB')
+        tracemalloc.stop()
+    token_cache.clear()
+
+
+@video_cli.command('benchmark-validation')
+@click.option('--repeat', default=20000, help='Validations per endpoint and path.')
+def benchmark_validation(repeat):
+    """
+    Validations per second of create body and search params: trim loop and new schema per request against
+    compiled validators. Also checks both give the same errors on valid and invalid input.
+    """
+
+    def trim_all(body):
+        return {key: str(value).strip() for key, value in body.items()}
+
+    def no_trim(body):
+        return body
+
+    endpoints = [
+        ('create', CreateVideoSchema, trim_all, create_video_validator, [
+            {'title': ' This is the first video ', 'url': 'https://video.com/123',
+             'thumbnail_url': 'https://thumbnail.com/123'},
+            {'title': 'x' * 501, 'url': ''},
+            {'url': 'https://video.com/123', 'extra': 1},
+        ]),
+        ('search', SearchVideoSchema, no_trim, search_video_validator, [
+            {'keyword': 'music', 'limit': '20', 'order': 'desc'},
+            {},
+            {'limit': '0', 'order': 'up', 'cursor': ''},
+            {'limit': 'ten', 'page': '2'},
+        ]),
+    ]
+    for name, schema_class, trim, validator, bodies in endpoints:
+        def schema_path(body):
+            return schema_class().validate(trim(body))
+
+        mismatches = sum(1 for body in bodies if schema_path(body) != validator.validate(body)[1])
+        rates = []
+        for fn in (schema_path, validator.validate):
+            start = time.perf_counter()
+            for i in range(repeat):
+                fn(bodies[i % len(bodies)])
+            rates.append(repeat / (time.perf_counter() - start))
+        click.echo(f'{name:<7} schema={rates[0]:>9,.0f}/s compiled={rates[1]:>9,.0f}/s '
+                   f'x{rates[1] / rates[0]:.1f} mismatches={mismatches}')
+
+
+@video_cli.command('check-query-plans')
+@click.option('--seed', default=0, help='Insert this number of random videos before checking, plans of a nearly '
+                                        'empty table may differ from production.')
+@click.option('--verbose', is_flag=True, help='Print the plan of every combination.')
+def check_query_plans(seed, verbose):
+    """
+    Check every supported combination of listing filters, sort, order and cursor is planned as an index scan,
+    with neither full table scan nor sort of all matching rows. Exit with status 1 otherwise. MySQL and SQLite only.
+    """
+
+    dialect = db.engine.dialect.name
+    if dialect not in ('mysql', 'sqlite'):
+        raise click.ClickException(f'Query plans of {dialect} are not supported')
+    if seed:
+        insert_random_videos(seed)
+        click.echo(f'Inserted {seed} videos')
+
+    plans = listing_query_plans(get_timestamp_now())
+    failures = sum(not plan['is_ok'] for plan in plans)
+    sorted_ranges = sum(plan['is_ok'] and plan['is_sorted'] for plan in plans)
+    for plan in plans:
+        if verbose or not plan['is_ok']:
+            click.echo(f'{"ok  " if plan["is_ok"] else "FAIL"} sort={plan["sort"]} '
+                       f'order={"desc" if plan["descending"] else "asc"} {plan["filters"]} cursor={plan["cursor"]} '
+                       f'index={plan["index"]}: {plan["details"]}')
+    click.echo(f'{len(plans) - failures}/{len(plans)} combinations use an index scan, {sorted_ranges} of them sort '
+               f'the rows of a created date range')
+    if failures:
+        raise SystemExit(1)
@@ -0,0 +1,64 @@
+import gzip
+from flask import request
+from video_app.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+class Compressor(object):
+    """
+    Compress response bodies of at least COMPRESS_MIN_SIZE bytes with the encoding the client prefers,
+    brotli (when installed) or gzip. Only COMPRESS_MIMETYPES are compressed, streamed bodies are sent as they are.
+    """
+
+    def __init__(self):
+        self.min_size = 1024
+        self.mimetypes = frozenset()
+        self.gzip_level = 6
+        self.brotli_quality = 5
+        self.encodings = ['gzip']
+        self.counters = {'compressed': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def init_app(self, app):
+        config = app.config
+        self.min_size = config['COMPRESS_MIN_SIZE']
+        self.mimetypes = frozenset(config['COMPRESS_MIMETYPES'])
+        self.gzip_level = config['COMPRESS_GZIP_LEVEL']
+        self.brotli_quality = config['COMPRESS_BROTLI_QUALITY']
+        self.encodings = (['br'] if brotli is not None else []) + ['gzip']
+        app.after_request(self.compress)
+
+    def compress(self, response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or response.mimetype not in self.mimetypes or 'Content-Encoding' in response.headers):
+            return response
+
+        # caches must keep one copy per encoding, even when this body is too small to be compressed
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+
+        with metrics.timed('compress'):
+            if encoding == 'br':
+                data = brotli.compress(body, quality=self.brotli_quality)
+            else:
+                data = gzip.compress(body, self.gzip_level, mtime=0)
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        self.counters['compressed'] += 1
+        self.counters['bytes_in'] += len(body)
+        self.counters['bytes_out'] += len(data)
+        return response
+
+    def stats(self) -> dict:
+        return dict(self.counters, encodings=self.encodings)
+
+
+compressor = Compressor()
@@ -0,0 +1,126 @@
+import random
+from contextlib import contextmanager
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that runs selects on a replica inside db.replica() blocks, everything else on the primary.
+
+    Once the session has written, it stays on the primary until it is removed at the end of the request,
+    so a request always reads its own writes.
+    """
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.db = db
+        event.listen(self, 'after_flush', _mark_written)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not self.info.get('written'):
+            if getattr(clause, 'is_select', False):
+                return self.db.get_engine(self.app, bind=replica)
+            if getattr(clause, 'is_dml', False):
+                self.info['written'] = True
+        return super().get_bind(mapper, clause)
+
+
+def _mark_written(session, flush_context):
+    session.info['written'] = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy with engine and pool options from DATABASE_* settings and read replicas from
+    SQLALCHEMY_REPLICA_URIS, each replica is a bind named replica_<n> without any table.
+    """
+
+    def init_app(self, app):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for index, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS']):
+            binds[f'{REPLICA_BIND_PREFIX}{index}'] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        config = app.config
+        options['pool_pre_ping'] = config['DATABASE_POOL_PRE_PING']
+        options['pool_recycle'] = config['DATABASE_POOL_RECYCLE']
+        if sa_url.drivername.startswith('sqlite'):
+            # file databases are opened per checkout (NullPool), there is no pool to size
+            return sa_url, options
+
+        options['pool_size'] = config['DATABASE_POOL_SIZE']
+        options['max_overflow'] = config['DATABASE_MAX_OVERFLOW']
+        timeout = int(config['DATABASE_STATEMENT_TIMEOUT'] * 1000)
+        if timeout:
+            connect_args = options.setdefault('connect_args', {})
+            if sa_url.drivername.startswith('mysql'):
+                # selects only, writes are never cut in the middle
+                connect_args['init_command'] = f'SET SESSION max_execution_time={timeout}'
+            elif sa_url.drivername.startswith('postgresql'):
+                connect_args['options'] = f'-c statement_timeout={timeout}'
+        return sa_url, options
+
+    def dispose(self, app=None) -> None:
+        """
+        Close pooled connections of every engine, e.g. in gunicorn master before workers are forked,
+        so no worker shares a socket with another process
+        """
+
+        app = self.get_app(app)
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or ()):
+            self.get_engine(app, bind).dispose()
+
+    def warm_pool(self, connections: int, app=None) -> None:
+        """
+        Open up to connections pooled connections of the primary now rather than on first requests
+        """
+
+        engine = self.get_engine(self.get_app(app))
+        if not isinstance(engine.pool, QueuePool):
+            return
+        opened = [engine.connect() for _ in range(min(connections, engine.pool.size()))]
+        for connection in opened:
+            connection.close()
+
+    @contextmanager
+    def replica(self):
+        """
+        Run selects of the block on a random replica, on the primary if there is none.
+        Use it for reads that can be a little behind, replicas lag the primary.
+        :return: bind name of the replica, None if there is none
+        """
+
+        replicas = [bind for bind in self.get_app().config['SQLALCHEMY_BINDS'] or ()
+                    if bind.startswith(REPLICA_BIND_PREFIX)]
+        session = self.session()
+        previous = session.info.get('replica')
+        replica = session.info['replica'] = random.choice(replicas) if replicas else None
+        try:
+            yield replica
+        finally:
+            session.info['replica'] = previous
+
+    def replica_or_primary(self, fn, *args):
+        """
+        Call fn in a replica block, again on the primary if it finds nothing: the row may be too new for the replica
+        :param fn: read function returning None when nothing is found
+        :param args: arguments of fn
+        :return: result of fn
+        """
+
+        with self.replica() as replica:
+            result = fn(*args)
+        if result is None and replica is not None:
+            result = fn(*args)
+        return result
@@ -1,3 +1,9 @@
 # coding: utf-8
 TIME_FORMAT_LOG = "[%Y-%b-%d %H:%M]"
 VALIDATE_TOKEN_URL = "http://localhost:5012/api/v1/auth/tokens/validate"
+VALIDATE_TOKENS_URL = "http://localhost:5012/api/v1/auth/tokens/validate/batch"
+TOKEN_KEYS_URL = "http://localhost:5012/api/v1/auth/tokens/keys"
+# revocation log of auth_service in redis, see RedisRevocationSet of auth_service
+REVOCATION_KEY_PREFIX = "auth:revoked:"  # + jti, set until the revoked token expires
+REVOCATION_LOG_KEY = "auth:revoked:log"
+REVOCATION_EPOCH_KEY = "auth:revoked:epoch"
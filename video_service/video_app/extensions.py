@@ -1,18 +1,28 @@
 import logging
 import os
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from flask_redis import Redis
 from logging.handlers import RotatingFileHandler
+from video_app.database import RoutingSQLAlchemy
+from video_app.log_handlers import JsonFormatter, AsyncLogHandler
+from video_app.gateway_client import AuthServiceClient
 
 
-# init SQLAlchemy
-db = SQLAlchemy()
+# init SQLAlchemy, selects in db.replica() blocks go to read replicas
+db = RoutingSQLAlchemy()
 migrate = Migrate()
+redis = Redis()
+
+# http client of auth_service
+auth_client = AuthServiceClient()
 
 os.makedirs("logs", exist_ok=True)
 app_log_handler = RotatingFileHandler('logs/app.log', maxBytes=1000000, backupCount=30, encoding="UTF-8")
+app_log_handler.setFormatter(JsonFormatter())
+# file is written by a background thread, requests only put records on a bounded queue
+log_handler = AsyncLogHandler(app_log_handler)
 
 # logger
 logger = logging.getLogger('api')
 logger.setLevel(logging.DEBUG)
-logger.addHandler(app_log_handler)
+logger.addHandler(log_handler)
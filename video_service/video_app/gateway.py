@@ -1,14 +1,467 @@
-import requests
+import hashlib
+import json
+import threading
+import time
+import jwt
+from collections import OrderedDict
 from functools import wraps
-from flask import request
-from video_app.enums import VALIDATE_TOKEN_URL
+from flask import request, current_app
+from jwt.algorithms import RSAAlgorithm
+from redis import RedisError
+from video_app.enums import (VALIDATE_TOKEN_URL, VALIDATE_TOKENS_URL, TOKEN_KEYS_URL, REVOCATION_KEY_PREFIX,
+                             REVOCATION_LOG_KEY, REVOCATION_EPOCH_KEY)
 from video_app.utils import logged_error
 from video_app.api.helper import send_error
+from video_app.extensions import auth_client, redis
+from video_app.gateway_client import AuthServiceUnavailable
+from video_app.metrics import metrics
+
+
+class KeySet(object):
+    """
+    Public keys of auth_service, fetched from TOKEN_KEYS_URL and cached by kid.
+
+    Keys are fetched again when they are older than AUTH_KEYS_MAX_AGE, or when a token is signed
+    with an unknown kid (key rotation), at most once per AUTH_KEYS_MIN_REFRESH_INTERVAL.
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def get(self, kid: str):
+        """
+        Get public key by kid
+        :param kid:
+        :return: public key or None
+        """
+
+        config = current_app.config
+        fetched_at = self._fetched_at
+        age = float('inf') if fetched_at is None else time.monotonic() - fetched_at
+        if age >= config['AUTH_KEYS_MAX_AGE'] or \
+                (kid not in self._keys and age >= config['AUTH_KEYS_MIN_REFRESH_INTERVAL']):
+            self.refresh(fetched_at)
+        return self._keys.get(kid)
+
+    def refresh(self, seen_fetched_at: float = None) -> None:
+        """
+        Fetch key set from auth_service
+        :param seen_fetched_at: skip if another thread fetched keys after this time
+        :return:
+        """
+
+        with self._lock:
+            if seen_fetched_at is not None and self._fetched_at != seen_fetched_at:
+                return
+            try:
+                res = auth_client.get(TOKEN_KEYS_URL).json()
+                self._keys = {jwk['kid']: RSAAlgorithm.from_jwk(json.dumps(jwk)) for jwk in res['data']['keys']}
+            except Exception as ex:
+                # keep old keys, auth_service may be restarting
+                logged_error(f"Fetch token keys failed: {ex}")
+            self._fetched_at = time.monotonic()
+
+
+key_set = KeySet()
+
+
+class TokenCache(object):
+    """
+    Bounded LRU cache of token validation results, keyed by sha256 of Authorization header.
+
+    A valid result lives until the token expires or AUTH_CACHE_MAX_TTL, whichever ends first, an invalid
+    result lives AUTH_CACHE_NEGATIVE_TTL. Least recently used entries are evicted above AUTH_CACHE_SIZE.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()  # key -> (is_valid, expires_at, jti)
+        self._jti_keys = {}
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'purged': 0}
+
+    @staticmethod
+    def make_key(authorization: str) -> str:
+        return hashlib.sha256(authorization.encode()).hexdigest()
+
+    def get(self, key: str):
+        """
+        Get cached result
+        :param key:
+        :return: True/False, None if not cached
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def set(self, key: str, is_valid: bool, expires: int = None, jti: str = None) -> None:
+        """
+        Cache result
+        :param key:
+        :param is_valid:
+        :param expires: exp claim of token
+        :param jti: jti claim of token, used to purge entry when token is revoked
+        :return:
+        """
+
+        config = current_app.config
+        max_size = config['AUTH_CACHE_SIZE']
+        ttl = config['AUTH_CACHE_MAX_TTL'] if is_valid else config['AUTH_CACHE_NEGATIVE_TTL']
+        if expires:
+            ttl = min(ttl, expires - time.time())
+        if max_size <= 0 or ttl <= 0:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (is_valid, time.monotonic() + ttl, jti)
+            if jti:
+                self._jti_keys.setdefault(jti, set()).add(key)
+            while len(self._entries) > max_size:
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def purge(self, authorization: str = None, jti: str = None) -> int:
+        """
+        Remove entries of a revoked token
+        :param authorization: Authorization header
+        :param jti: jti claim of token
+        :return: number of removed entries
+        """
+
+        keys = set()
+        if authorization:
+            keys.add(self.make_key(authorization))
+        with self._lock:
+            if jti:
+                keys.update(self._jti_keys.get(jti, ()))
+            removed = sum(1 for key in keys if self._remove(key))
+            self.counters['purged'] += removed
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._jti_keys.clear()
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        jti = entry[2]
+        if jti and jti in self._jti_keys:
+            self._jti_keys[jti].discard(key)
+            if not self._jti_keys[jti]:
+                del self._jti_keys[jti]
+        return True
+
+    def stats(self) -> dict:
+        return dict(self.counters, size=len(self._entries))
+
+
+token_cache = TokenCache()
+
+
+class RevocationFeed(object):
+    """
+    Purge token cache entries of tokens revoked on auth_service, read from its revocation log in redis every
+    AUTH_CACHE_REVOCATION_SYNC_INTERVAL seconds. A revoked token is then rejected by every worker after at most
+    this interval, not AUTH_CACHE_MAX_TTL.
+    """
+
+    def __init__(self):
+        self._position = None  # (epoch, log length) read so far
+        self._synced_at = 0
+        self._lock = threading.Lock()
+        self.counters = {'syncs': 0, 'purged_jtis': 0, 'resets': 0, 'errors': 0}
+
+    def sync(self) -> None:
+        interval = current_app.config['AUTH_CACHE_REVOCATION_SYNC_INTERVAL']
+        if interval <= 0 or time.monotonic() - self._synced_at < interval:
+            return
+        # one request of the worker reads the log, the others go on
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._synced_at = time.monotonic()
+            self._read_log()
+            self.counters['syncs'] += 1
+        except RedisError as ex:
+            self.counters['errors'] += 1
+            logged_error(f"Read token revocation log failed: {ex}")
+        finally:
+            self._lock.release()
+
+    def _read_log(self) -> None:
+        pipe = redis.pipeline()
+        pipe.get(REVOCATION_EPOCH_KEY)
+        if self._position is None:
+            # nothing cached was revoked before the first read
+            pipe.llen(REVOCATION_LOG_KEY)
+            self._position = tuple(pipe.execute())
+            return
+
+        epoch, offset = self._position
+        pipe.lrange(REVOCATION_LOG_KEY, offset, -1)
+        current_epoch, jtis = pipe.execute()
+        if current_epoch != epoch:
+            # log was reset by auth_service, revocations since last read may be gone with it
+            token_cache.clear()
+            self.counters['resets'] += 1
+            self._position = None
+            return
+        self._position = (epoch, offset + len(jtis))
+        for jti in jtis:
+            token_cache.purge(jti=jti.decode())
+        self.counters['purged_jtis'] += len(jtis)
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+revocation_feed = RevocationFeed()
+
+
+def get_unverified_claims(authorization: str) -> dict:
+    """
+    Read claims of "Bearer <token>" without verifying it, only used to bound cache ttl
+    """
+
+    try:
+        return jwt.decode(authorization.split()[-1], verify=False)
+    except Exception:
+        return {}
+
+
+def verify_token_locally(authorization: str) -> dict:
+    """
+    Verify signature, expiry and type of access token without calling auth_service, and that it is not revoked
+    in the revocation set auth_service keeps in redis
+    Args:
+        authorization: Authorization header, "Bearer <token>"
+    Returns:
+        claims of token, raise jwt.InvalidTokenError if token is invalid, RedisError if revocations can not be read
+    """
+
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0] != 'Bearer':
+        raise jwt.InvalidTokenError('Missing Bearer token')
+    token = parts[1]
+    kid = jwt.get_unverified_header(token).get('kid')
+    key = key_set.get(kid)
+    if key is None:
+        raise jwt.InvalidTokenError(f'Unknown kid: {kid}')
+    claims = jwt.decode(token, key, algorithms=current_app.config['AUTH_JWT_ALGORITHMS'])
+    if claims.get('type') != 'access':
+        raise jwt.InvalidTokenError('Only access tokens are allowed')
+    if not claims.get('jti'):
+        raise jwt.InvalidTokenError('Missing jti')
+    if redis.exists(REVOCATION_KEY_PREFIX + claims['jti']):
+        raise jwt.InvalidTokenError('Token has been revoked')
+    return claims
+
+
+def verify_token_remotely(authorization: str) -> bool:
+    """
+    Validate token by calling validate token api of auth_service
+    Args:
+        authorization: Authorization header
+    Returns:
+        valid or not, raise AuthServiceUnavailable if auth_service can not be reached
+    """
+
+    try:
+        res = auth_client.get(VALIDATE_TOKEN_URL, headers={"Authorization": authorization}).json()
+    except AuthServiceUnavailable:
+        raise
+    except Exception as ex:
+        logged_error(f"Call validate token api failed: {ex}")
+        return False
+    return 'message' in res and res['message']['status'] == 'success'
+
+
+def verify_tokens_remotely(authorizations: list) -> list:
+    """
+    Validate many tokens with one call of validate tokens batch api of auth_service
+    Args:
+        authorizations: Authorization headers, at most AUTH_BATCH_MAX_SIZE
+    Returns:
+        valid or not of each header, raise AuthServiceUnavailable if auth_service can not be reached
+    """
+
+    max_length = current_app.config['AUTH_TOKEN_MAX_LENGTH']
+    tokens = []
+    for authorization in authorizations:
+        parts = authorization.split()
+        # malformed tokens are invalid without being sent, they must not fail the batch of other users
+        is_jwt = len(parts) == 2 and parts[0] == 'Bearer' and len(parts[1]) <= max_length and \
+            parts[1].count('.') == 2
+        tokens.append(parts[1] if is_jwt else None)
+    sent = list(dict.fromkeys(token for token in tokens if token))
+    if not sent:
+        return [False] * len(tokens)
+
+    try:
+        # read only, safe to retry like a GET
+        res = auth_client.request('POST', VALIDATE_TOKENS_URL, retries=auth_client.max_retries,
+                                  json={'tokens': sent})
+        body = res.json() if res.status_code < 400 else {}
+        results = body['data']['tokens'] if body.get('message', {}).get('status') == 'success' else None
+        if not isinstance(results, list) or len(results) != len(sent):
+            raise ValueError(f'Unexpected response, status code {res.status_code}: {res.text[:200]}')
+        statuses = {token: result.get('status') for token, result in zip(sent, results)}
+    except AuthServiceUnavailable:
+        raise
+    except Exception as ex:
+        # e.g. a token auth_service rejects the whole batch for, check them one by one
+        logged_error(f"Call validate tokens api failed, checking tokens one by one: {ex}")
+        return [verify_token_remotely(authorization) if token else False
+                for authorization, token in zip(authorizations, tokens)]
+    return [statuses.get(token) == 'valid' for token in tokens]
+
+
+class TokenBatch(object):
+    """
+    Authorization headers waiting to be validated together, and their results once sent
+    """
+
+    def __init__(self):
+        self.authorizations = {}  # ordered, a header checked twice is sent once
+        self.results = {}
+        self.error = None  # message of AuthServiceUnavailable
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class TokenBatcher(object):
+    """
+    Coalesce concurrent remote token checks of a worker into calls of validate tokens batch api.
+
+    The first check opens a batch, waits AUTH_BATCH_WINDOW seconds or until AUTH_BATCH_MAX_SIZE tokens joined,
+    then sends it and wakes the checks that joined meanwhile with their result. Every check waits up to the
+    window even when it is alone, keep it small.
+    """
+
+    def __init__(self):
+        self._batch = None
+        self._lock = threading.Lock()
+        self.counters = {'checks': 0, 'coalesced': 0, 'batches': 0, 'tokens': 0}
+
+    def check(self, authorization: str) -> bool:
+        """
+        Validate token together with concurrent checks
+        :param authorization: Authorization header
+        :return: valid or not, raise AuthServiceUnavailable if auth_service can not be reached
+        """
+
+        config = current_app.config
+        with self._lock:
+            self.counters['checks'] += 1
+            batch = self._batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self._batch = TokenBatch()
+            if authorization in batch.authorizations:
+                self.counters['coalesced'] += 1
+            else:
+                batch.authorizations[authorization] = None
+            if len(batch.authorizations) >= config['AUTH_BATCH_MAX_SIZE']:
+                # closed, next check opens a new batch
+                self._batch = None
+                batch.full.set()
+
+        if is_leader:
+            batch.full.wait(config['AUTH_BATCH_WINDOW'])
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._send(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise AuthServiceUnavailable(batch.error)
+        return batch.results[authorization]
+
+    def _send(self, batch: TokenBatch) -> None:
+        authorizations = list(batch.authorizations)
+        self.counters['batches'] += 1
+        self.counters['tokens'] += len(authorizations)
+        try:
+            batch.results = dict(zip(authorizations, verify_tokens_remotely(authorizations)))
+        except AuthServiceUnavailable as ex:
+            batch.error = str(ex)
+        except Exception as ex:
+            logged_error(f"Validate tokens batch failed: {ex}")
+            batch.results = dict.fromkeys(authorizations, False)
+        finally:
+            # never leave the others waiting
+            batch.done.set()
+
+    def stats(self) -> dict:
+        return dict(self.counters, average_batch=round(self.counters['tokens'] / (self.counters['batches'] or 1), 2))
+
+
+token_batcher = TokenBatcher()
+
+
+def check_authorization(authorization: str) -> bool:
+    """
+    Validate Authorization header, use cached result if any
+    Args:
+        authorization: Authorization header
+    Returns:
+        valid or not
+    """
+
+    revocation_feed.sync()
+    key = token_cache.make_key(authorization)
+    is_valid = token_cache.get(key)
+    if is_valid is not None:
+        return is_valid
+
+    is_valid = None
+    if current_app.config['AUTH_VERIFY_MODE'] == 'local':
+        try:
+            verify_token_locally(authorization)
+            is_valid = True
+        except jwt.InvalidTokenError as ex:
+            logged_error(f"Verify token failed: {ex}")
+            is_valid = False
+        except RedisError as ex:
+            # revocations can not be read, ask auth_service
+            logged_error(f"Check revoked token in redis failed: {ex}")
+    if is_valid is None:
+        try:
+            if current_app.config['AUTH_BATCH_WINDOW'] > 0:
+                is_valid = token_batcher.check(authorization)
+            else:
+                is_valid = verify_token_remotely(authorization)
+        except AuthServiceUnavailable as ex:
+            # do not cache, auth_service may be back soon
+            logged_error(f"Call validate token api failed: {ex}")
+            return False
+
+    claims = get_unverified_claims(authorization)
+    token_cache.set(key, is_valid, claims.get('exp'), claims.get('jti'))
+    return is_valid
 
 
 def authorization_require():
     """
-    Validate token by auth_service
+    Validate token by auth_service, locally or remotely depend on AUTH_VERIFY_MODE
     Args:
 
     Returns:
@@ -18,14 +471,11 @@ def authorization_require():
         @wraps(fn)
         def decorator(*args, **kwargs):
             authorization = request.headers.get('Authorization', '').strip()
-            try:
-                res = requests.get(VALIDATE_TOKEN_URL, headers={"Authorization": authorization}).json()
-            except Exception as ex:
-                logged_error(f"Call validate token api failed: {ex}")
-                return send_error(message="You don't have permission")
-            if 'message' in res and res['message']['status'] == 'success':
+            with metrics.timed('auth'):
+                is_valid = check_authorization(authorization)
+            if is_valid:
                 return fn(*args, **kwargs)
             else:
                 return send_error(message="You don't have permission")
         return decorator
-    return wrapper
\ No newline at end of file
+    return wrapper
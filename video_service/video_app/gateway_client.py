@@ -0,0 +1,175 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class AuthServiceUnavailable(Exception):
+    """
+    auth_service can not be reached: circuit is open, timeout or connection error after retries
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Open after failure_threshold consecutive failures, then reject calls until reset_timeout passed.
+    After that one trial call is allowed (half open), it closes the circuit if it succeeds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.opened_count = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                return True
+            # only one trial call at a time when half open
+            return self.state == self.CLOSED
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.opened_count += 1
+
+
+class AuthServiceClient(object):
+    """
+    HTTP client of auth_service.
+
+    Keep a pool of keep-alive connections per worker process, with connect/read timeouts, retries with
+    jittered backoff for idempotent calls and a circuit breaker that fails fast while auth_service is down.
+    """
+
+    def __init__(self):
+        self.pool_size = 10
+        self.timeout = (0.5, 2)
+        self.max_retries = 2
+        self.backoff_base = 0.05
+        self.backoff_max = 0.5
+        self.circuit = CircuitBreaker()
+        self.counters = {'requests': 0, 'retries': 0, 'timeouts': 0, 'failures': 0, 'short_circuited': 0}
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Read client config
+        :param app:
+        :return:
+        """
+
+        config = app.config
+        self.pool_size = config['AUTH_CLIENT_POOL_SIZE']
+        self.timeout = (config['AUTH_CLIENT_CONNECT_TIMEOUT'], config['AUTH_CLIENT_READ_TIMEOUT'])
+        self.max_retries = config['AUTH_CLIENT_MAX_RETRIES']
+        self.backoff_base = config['AUTH_CLIENT_BACKOFF_BASE']
+        self.backoff_max = config['AUTH_CLIENT_BACKOFF_MAX']
+        self.circuit = CircuitBreaker(config['AUTH_CLIENT_FAILURE_THRESHOLD'], config['AUTH_CLIENT_RESET_TIMEOUT'])
+
+    @property
+    def session(self) -> requests.Session:
+        # sockets must not be shared with the master process after fork, so one session per pid
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        GET is idempotent so it is retried on timeout, connection error and 5xx response
+        :param url:
+        :param kwargs: passed to requests
+        :return: response, raise AuthServiceUnavailable if auth_service can not be reached
+        """
+        return self.request('GET', url, retries=self.max_retries, **kwargs)
+
+    def request(self, method: str, url: str, retries: int = 0, **kwargs) -> requests.Response:
+        if not self.circuit.allow():
+            self.counters['short_circuited'] += 1
+            raise AuthServiceUnavailable('Circuit is open')
+
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        recorded = False
+        try:
+            while True:
+                self.counters['requests'] += 1
+                try:
+                    res = self.session.request(method, url, **kwargs)
+                    if res.status_code < 500:
+                        self.circuit.record_success()
+                        recorded = True
+                        return res
+                    error = f'Status code {res.status_code}'
+                except requests.Timeout as ex:
+                    self.counters['timeouts'] += 1
+                    error = str(ex)
+                except requests.RequestException as ex:
+                    # connection error, broken chunked or compressed body, ...
+                    error = str(ex)
+
+                if attempt >= retries:
+                    self.counters['failures'] += 1
+                    self.circuit.record_failure()
+                    recorded = True
+                    raise AuthServiceUnavailable(error)
+                attempt += 1
+                self.counters['retries'] += 1
+                # full jitter backoff
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+        finally:
+            if not recorded:
+                # any other error is a failure too, a half open circuit would otherwise never close or reopen
+                self.counters['failures'] += 1
+                self.circuit.record_failure()
+
+    def stats(self) -> dict:
+        """
+        Counters of client, pool_hits is number of requests sent on a reused keep-alive connection
+        :return:
+        """
+
+        pool_hits = 0
+        new_connections = 0
+        if self._session is not None:
+            for adapter in set(self._session.adapters.values()):
+                for pool in adapter.poolmanager.pools._container.values():
+                    # failed connects are counted in num_connections but not in num_requests
+                    pool_hits += max(0, pool.num_requests - pool.num_connections)
+                    new_connections += pool.num_connections
+        return dict(self.counters,
+                    pool_size=self.pool_size,
+                    new_connections=new_connections,
+                    pool_hits=pool_hits,
+                    circuit_state=self.circuit.state,
+                    circuit_opened=self.circuit.opened_count)
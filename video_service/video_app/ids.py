@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+import uuid
+from sqlalchemy import MetaData, Table, and_, inspect, or_, text
+from sqlalchemy.types import BINARY, String, TypeDecorator
+
+# ids of rows written before ids were binary but that are not uuids, e.g. "benchmark-1", are mapped
+# to uuid5(LEGACY_ID_NAMESPACE, id), the same way in every table so references stay consistent
+LEGACY_ID_NAMESPACE = uuid.UUID('6f1c2a52-8d0e-4c1b-9b4e-2f9a7d3c5e10')
+
+_lock = threading.Lock()
+_last = [0, 0]  # milliseconds and sequence of the last id of this process
+
+
+def new_id() -> str:
+    """
+    Time ordered 128 bit id, uuid version 7: 48 bit unix milliseconds, 12 bit sequence, 62 random bits.
+    Ids of a process are strictly increasing, so inserts append to the end of primary key indexes.
+    :return: canonical uuid form, stored as 16 bytes by BinaryId
+    """
+
+    with _lock:
+        milliseconds = time.time_ns() // 1000000
+        if milliseconds > _last[0]:
+            _last[0], _last[1] = milliseconds, int.from_bytes(os.urandom(2), 'big') & 0x7ff
+        else:
+            # same millisecond or clock went back: next sequence, borrow the next millisecond when it is full
+            _last[1] += 1
+            if _last[1] > 0xfff:
+                _last[0], _last[1] = _last[0] + 1, 0
+        milliseconds, sequence = _last
+    value = (milliseconds << 80) | (0x7 << 76) | (sequence << 64) | (0b10 << 62) | \
+        (int.from_bytes(os.urandom(8), 'big') >> 2)
+    return format_id(value.to_bytes(16, 'big'))
+
+
+def format_id(value: bytes) -> str:
+    """
+    Canonical uuid form of 16 bytes id, same order as the bytes
+    """
+
+    h = value.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+def parse_id(value: str) -> bytes:
+    """
+    16 bytes of an id in uuid form, with or without dashes
+    :param value:
+    :return: raise ValueError if value is not an id
+    """
+
+    try:
+        raw = bytes.fromhex(value.replace('-', ''))
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f'Invalid id: {value!r}')
+    if len(raw) != 16:
+        raise ValueError(f'Invalid id: {value!r}')
+    return raw
+
+
+def legacy_id(value: str) -> bytes:
+    """
+    16 bytes of an id written before ids were binary: the uuid itself, uuid5 of the string otherwise
+    """
+
+    try:
+        return parse_id(value)
+    except ValueError:
+        return uuid.uuid5(LEGACY_ID_NAMESPACE, value).bytes
+
+
+class BinaryId(TypeDecorator):
+    """
+    Id column stored as BINARY(16), str in canonical uuid form in python and at the api.
+    Byte order and string order are the same, so keyset cursors compare ids either way.
+    """
+
+    impl = BINARY(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return parse_id(value)
+
+    def literal_processor(self, dialect):
+        # hex literal, understood by mysql and sqlite, BINARY would render the bytes as a string
+        def process(value):
+            return f"X'{self.process_bind_param(value, dialect).hex()}'"
+        return process
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return format_id(bytes(value))
+
+
+def migrate_table(engine, table: Table, id_columns: list, batch_size: int = 1000, drop_old: bool = False,
+                  echo=print) -> int:
+    """
+    Convert a table written before ids were binary to the schema of table.
+
+    Rows are copied in batches in primary key order to <name>_new, created without indexes, id_columns
+    converted by legacy_id. Rows with the same new primary key are copied once. Then the old table is renamed
+    to <name>_old without its secondary indexes, <name>_new to <name>, and the indexes are built.
+    Stop the service first, rows written during the copy would be lost. Can be run again: a converted table
+    is left as it is, an unfinished copy is started over.
+    :param engine:
+    :param table: new schema, e.g. Video.__table__
+    :param id_columns: names of id columns to convert
+    :param batch_size: rows per insert and transaction
+    :param drop_old: drop <name>_old once rows are copied
+    :param echo: progress output
+    :return: number of copied rows, 0 if table is already converted
+    """
+
+    name = table.name
+    quote = engine.dialect.identifier_preparer.quote
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    if name not in tables:
+        table.create(engine)
+        return 0
+    id_type = next(column['type'] for column in inspector.get_columns(name) if column['name'] == id_columns[0])
+    if not isinstance(id_type, String):
+        # legacy ids are VARCHAR, sqlite reflects BINARY(16) as NUMERIC
+        return 0
+
+    new_table = table.to_metadata(MetaData(), name=f'{name}_new')
+    new_table.indexes.clear()  # built after the copy, faster than keeping them up to date row by row
+    if new_table.name in tables:
+        new_table.drop(engine)
+        echo(f'Dropped unfinished copy {new_table.name}')
+    new_table.create(engine)
+
+    old_table = Table(name, MetaData(), autoload_with=engine)
+    old_key = [old_table.c[column] for column in inspector.get_pk_constraint(name)['constrained_columns']]
+    columns = [column.name for column in table.columns if column.name in old_table.c]
+    new_key = [column.name for column in table.primary_key]
+    copied = 0
+    duplicates = 0
+    last = None
+    previous_key = None
+    while True:
+        query = old_table.select().order_by(*old_key).limit(batch_size)
+        if last is not None:
+            # keyset on old primary key: (k1 > v1) OR (k1 = v1 AND k2 > v2) ...
+            query = query.where(or_(*[and_(*[c == v for c, v in zip(old_key[:n], last[:n])], old_key[n] > last[n])
+                                      for n in range(len(old_key))]))
+        with engine.begin() as connection:
+            rows = connection.execute(query).fetchall()
+            if not rows:
+                break
+            last = [rows[-1]._mapping[column.name] for column in old_key]
+            batch = []
+            for row in rows:
+                values = {column: row._mapping[column] for column in columns}
+                for column in id_columns:
+                    if values[column] is not None:
+                        values[column] = legacy_id(values[column])
+                key = [values[column] for column in new_key]
+                if key == previous_key:
+                    duplicates += 1
+                    continue
+                previous_key = key
+                batch.append(values)
+            if batch:
+                connection.execute(new_table.insert(), batch)
+        copied += len(batch)
+        echo(f'Copied {copied} rows to {new_table.name}')
+    if duplicates:
+        echo(f'Skipped {duplicates} rows of {name} with the primary key of a copied row')
+
+    old_name = f'{name}_old'
+    with engine.begin() as connection:
+        # index names of sqlite are per database, they would clash with the indexes of the new table
+        for index in inspector.get_indexes(name):
+            on_table = f' ON {quote(name)}' if engine.dialect.name == 'mysql' else ''
+            connection.execute(text(f'DROP INDEX {quote(index["name"])}{on_table}'))
+        connection.execute(text(f'ALTER TABLE {quote(name)} RENAME TO {quote(old_name)}'))
+        connection.execute(text(f'ALTER TABLE {quote(new_table.name)} RENAME TO {quote(name)}'))
+    echo(f'Renamed {name} to {old_name} and {new_table.name} to {name}')
+    for index in table.indexes:
+        index.create(engine)
+        echo(f'Created index {index.name}')
+    if drop_old:
+        with engine.begin() as connection:
+            connection.execute(text(f'DROP TABLE {quote(old_name)}'))
+        echo(f'Dropped {old_name}')
+    return copied
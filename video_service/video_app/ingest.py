@@ -0,0 +1,153 @@
+import codecs
+import json
+from sqlalchemy.exc import SQLAlchemyError
+from video_app.cache import search_cache
+from video_app.extensions import db
+from video_app.ids import new_id
+from video_app.models import Video
+from video_app.utils import get_timestamp_now, logged_error
+from video_app.validator import create_video_validator
+
+
+def iter_ndjson(stream, max_row_size: int):
+    """
+    Rows of an NDJSON body, one line at a time
+    :param stream: request stream
+    :param max_row_size: longer lines are skipped and reported as errors
+    :return: iterator of (row, errors), errors is None if the line is valid json
+    """
+
+    while True:
+        line = stream.readline(max_row_size + 1)
+        if not line:
+            return
+        if len(line) > max_row_size and not line.endswith(b'\n'):
+            # skip the rest of the line without keeping it
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_row_size)
+            yield None, {'_schema': [f'Row is longer than {max_row_size} bytes.']}
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as ex:
+            yield None, {'_schema': [f'Invalid json: {ex}']}
+
+
+def iter_json_array(stream, max_row_size: int):
+    """
+    Items of a JSON array body, parsed piece by piece so the whole body is never in memory
+    :param stream: request stream
+    :param max_row_size: max size of one item
+    :return: iterator of (row, None), raise ValueError when the body can not be parsed any further
+    """
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    eof = False
+
+    def read_more():
+        nonlocal buffer, eof
+        chunk = stream.read(max_row_size)
+        eof = not chunk
+        buffer += text_decoder.decode(chunk, final=eof)
+
+    def next_char() -> str:
+        nonlocal buffer
+        while True:
+            buffer = buffer.lstrip()
+            if buffer or eof:
+                return buffer[:1]
+            read_more()
+
+    if next_char() != '[':
+        raise ValueError('Body must be a json array.')
+    buffer = buffer[1:]
+    if next_char() == ']':
+        return
+    while True:
+        next_char()
+        while True:
+            try:
+                row, end = decoder.raw_decode(buffer)
+                # a value ending with the buffer may go on in the next read
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError as ex:
+                if eof or len(buffer) > max_row_size:
+                    raise ValueError(f'Invalid json: {ex}')
+            read_more()
+        buffer = buffer[end:]
+        yield row, None
+
+        separator = next_char()
+        buffer = buffer[1:]
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError('Invalid json: expected "," or "]".')
+
+
+def ingest_videos(rows, chunk_size: int):
+    """
+    Validate videos as they arrive and insert them chunk_size at a time, one multi-row insert and one
+    transaction per chunk, so memory does not grow with the number of rows (except in DEBUG, where Flask-SQLAlchemy
+    records every query of the request)
+    :param rows: iterator of (row, errors) from iter_ndjson or iter_json_array
+    :param chunk_size:
+    :return: iterator of results, {"row": n, "video_id": id} or {"row": n, "errors": {...}} per row, in insert
+             order rather than row order, then {"summary": {"inserted": n, "failed": n}}
+    """
+
+    counts = {'inserted': 0, 'failed': 0}
+    chunk = []
+    row_number = 0
+    try:
+        for row_number, (row, errors) in enumerate(rows, 1):
+            if errors is None:
+                if isinstance(row, dict):
+                    # trim input like create video api
+                    row, errors = create_video_validator.validate(row)
+                else:
+                    errors = {'_schema': ['Row must be a json object.']}
+            if errors:
+                counts['failed'] += 1
+                yield {'row': row_number, 'errors': errors}
+                continue
+
+            chunk.append((row_number, row))
+            if len(chunk) >= chunk_size:
+                yield from insert_chunk(chunk, counts)
+                chunk = []
+    except ValueError as ex:
+        counts['failed'] += 1
+        yield {'row': row_number + 1, 'errors': {'_schema': [str(ex)]}}
+
+    yield from insert_chunk(chunk, counts)
+    yield {'summary': counts}
+
+
+def insert_chunk(chunk: list, counts: dict):
+    if not chunk:
+        return
+    now = get_timestamp_now()
+    videos = [Video.make_row(new_id(), row['title'], row.get('url', ''), row.get('thumbnail_url', ''), now)
+              for _, row in chunk]
+    try:
+        Video.add_videos_to_database(videos)
+    except SQLAlchemyError as ex:
+        db.session.rollback()
+        logged_error(f"Insert {len(chunk)} videos failed: {ex}")
+        counts['failed'] += len(chunk)
+        for row_number, _ in chunk:
+            yield {'row': row_number, 'errors': {'_schema': ['Insert failed.']}}
+        return
+
+    # search backends index new rows themselves: fulltext on insert, memory by rowid on next search
+    search_cache.invalidate()
+    counts['inserted'] += len(chunk)
+    for (row_number, _), video in zip(chunk, videos):
+        yield {'row': row_number, 'video_id': video['id']}
@@ -0,0 +1,117 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per line: time, level, message and the fields passed with extra={'fields': {...}}
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class AsyncLogHandler(QueueHandler):
+    """
+    Put records on a bounded queue, a background thread formats and writes them with the target handler.
+    A request never waits for file I/O or rotation: when the queue is full the record is dropped and counted.
+
+    Also decides which request inputs are logged: LOG_SAMPLE_RATES per endpoint, LOG_DEFAULT_SAMPLE_RATE for
+    others, and which fields are replaced by "***" before anything is serialised: LOG_REDACT_FIELDS.
+    """
+
+    def __init__(self, target: logging.Handler, queue_size: int = 10000):
+        super().__init__(None)
+        self.target = target
+        self.queue_size = queue_size
+        self.default_sample_rate = 1.0
+        self.sample_rates = {}
+        self.redact_fields = frozenset()
+        self.counters = {'queued': 0, 'dropped': 0, 'sampled_out': 0}
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def init_app(self, app):
+        config = app.config
+        self.queue_size = config['LOG_QUEUE_SIZE']
+        self.default_sample_rate = config['LOG_DEFAULT_SAMPLE_RATE']
+        self.sample_rates = config['LOG_SAMPLE_RATES']
+        self.redact_fields = frozenset(field.lower() for field in config['LOG_REDACT_FIELDS'])
+        self.stop()
+
+    def is_sampled(self, endpoint: str) -> bool:
+        rate = self.sample_rates.get(endpoint, self.default_sample_rate)
+        if rate >= 1 or random.random() < rate:
+            return True
+        self.counters['sampled_out'] += 1
+        return False
+
+    def redact(self, data):
+        """
+        Copy of data with values of secret fields replaced, at any depth
+        """
+
+        if isinstance(data, dict):
+            return {key: '***' if str(key).lower() in self.redact_fields else self.redact(value)
+                    for key, value in data.items()}
+        if isinstance(data, list):
+            return [self.redact(value) for value in data]
+        return data
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting is left to the background thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self._start()
+        try:
+            self.queue.put_nowait(record)
+            self.counters['queued'] += 1
+        except queue.Full:
+            self.counters['dropped'] += 1
+
+    def stop(self) -> None:
+        """
+        Write queued records and stop the background thread, it is started again by next record
+        """
+
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                try:
+                    self._listener.stop()
+                except queue.Full:
+                    # no room for the stop sentinel, the daemon thread ends with the process
+                    pass
+            self._listener = None
+            self._pid = None
+
+    def stats(self) -> dict:
+        return dict(self.counters, pending=self.queue.qsize() if self._listener is not None else 0)
+
+    def _start(self) -> None:
+        # threads do not survive fork, start one listener per worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.queue_size)
+                self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
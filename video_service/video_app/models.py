@@ -1,17 +1,69 @@
 # coding: utf-8
+from sqlalchemy import func
 from sqlalchemy.dialects.mysql import INTEGER
 from video_app.extensions import db
+from video_app.ids import BinaryId
 from video_app.utils import get_timestamp_now
 
 
 class Video(db.Model):
     __tablename__ = 'video'
+    __table_args__ = (
+        db.Index('ix_video_title_fulltext', 'title', mysql_prefix='FULLTEXT'),
+        db.Index('ix_video_created_date_id', 'created_date', 'id'),  # keyset pagination
+        # listing filters and sort, equality columns first then sort column, see search.listing_query
+        db.Index('ix_video_deleted_created_date_id', 'is_deleted', 'created_date', 'id'),
+        db.Index('ix_video_deleted_active_created_date_id', 'is_deleted', 'is_active', 'created_date', 'id'),
+        # trailing created_date: created date range is checked in the index, without reading rows
+        db.Index('ix_video_deleted_modified_date_id', 'is_deleted', 'modified_date', 'id', 'created_date'),
+        db.Index('ix_video_deleted_active_modified_date_id', 'is_deleted', 'is_active', 'modified_date', 'id',
+                 'created_date'),
+    )
 
-    id = db.Column(db.String(50), primary_key=True)
-    title = db.Column(db.String(500), primary_key=True)
+    id = db.Column(BinaryId, primary_key=True)  # ids.new_id(), time ordered
+    title = db.Column(db.String(500), nullable=False)
     url = db.Column(db.String(1000))
     thumbnail_url = db.Column(db.String(1000))
-    created_date = db.Column(INTEGER(unsigned=True), default=get_timestamp_now(), index=True)
+    created_date = db.Column(INTEGER(unsigned=True), default=get_timestamp_now)
     modified_date = db.Column(INTEGER(unsigned=True), default=0)
     is_deleted = db.Column(db.Boolean, default=0)
     is_active = db.Column(db.Boolean, default=1)
+
+    @staticmethod
+    def make_row(_id: str, title: str, url: str, thumbnail_url: str, created_date: int) -> dict:
+        """
+        Row of video table for multi-row inserts
+        """
+        return {
+            'id': _id,
+            'title': title,
+            'url': url,
+            'thumbnail_url': thumbnail_url,
+            'created_date': created_date,
+            'modified_date': 0,
+            'is_deleted': False,
+            'is_active': True,
+        }
+
+    @staticmethod
+    def add_videos_to_database(rows: list):
+        """
+        Adds videos with one executemany insert and one commit, sent as a multi-row insert by the mysql driver.
+        A single statement is compiled and cached whatever the number of rows.
+        :param rows: see make_row
+        """
+        db.session.execute(Video.__table__.insert(), rows)
+        db.session.commit()
+
+    @staticmethod
+    def get_newest() -> tuple:
+        """
+        Created date of newest videos and how many were created in that second, changes whenever a video is added.
+        Both are read from ix_video_created_date_id without scanning the table.
+        :return: (created_date, count), (0, 0) if there is no video
+        """
+        newest = db.session.query(func.max(Video.created_date)).scalar()
+        if newest is None:
+            return 0, 0
+        count = db.session.query(func.count()).select_from(Video).filter(Video.created_date == newest).scalar()
+        return newest, count
@@ -0,0 +1,458 @@
+import base64
+import bisect
+import heapq
+import itertools
+import json
+import math
+import re
+import threading
+import unicodedata
+from sqlalchemy import text, and_, or_
+from sqlalchemy.dialects.mysql import match
+from video_app.extensions import db
+from video_app.ids import parse_id
+from video_app.models import Video
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(value: str) -> list:
+    """
+    Split text to lower case tokens without accents, "Việt Nam" -> ["viet", "nam"]
+    :param value:
+    :return:
+    """
+
+    value = unicodedata.normalize('NFKD', value.casefold().replace('đ', 'd'))
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return TOKEN_RE.findall(value)
+
+
+def encode_cursor(sort_key: list) -> str:
+    """
+    Opaque cursor of a page, the sort key of its last video
+    """
+    return base64.urlsafe_b64encode(json.dumps(sort_key, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Sort key from cursor, raise ValueError if cursor is invalid
+    """
+
+    try:
+        sort_key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(sort_key, list) or len(sort_key) not in (2, 3) \
+            or not all(isinstance(value, (int, float)) for value in sort_key[:-2]) \
+            or not isinstance(sort_key[-2], int) or not isinstance(sort_key[-1], str):
+        raise ValueError('Invalid cursor')
+    parse_id(sort_key[-1])
+    return sort_key
+
+
+def keyset_filter(columns: list, values: list, descending: list):
+    """
+    Rows after values in (columns) order, expanded to OR/AND so the database can use a range scan:
+    (c1 > v1) OR (c1 = v1 AND c2 > v2) OR ...
+    :param columns:
+    :param values:
+    :param descending: direction of each column
+    :return:
+    """
+
+    clauses = []
+    for n, (column, value, is_desc) in enumerate(zip(columns, values, descending)):
+        equals = [c == v for c, v in zip(columns[:n], values[:n])]
+        clauses.append(and_(*equals, column < value if is_desc else column > value))
+    return or_(*clauses)
+
+
+def order_columns(columns: list, descending: list) -> list:
+    return [column.desc() if is_desc else column.asc() for column, is_desc in zip(columns, descending)]
+
+
+SORT_COLUMNS = {'created_date': Video.created_date, 'modified_date': Video.modified_date}
+
+
+def filter_conditions(filters: dict) -> list:
+    """
+    SQL conditions of listing filters
+    :param filters: is_deleted, is_active: bool or None for both, created_from, created_to: timestamp or None
+    :return:
+    """
+
+    conditions = []
+    if filters.get('is_deleted') is not None:
+        conditions.append(Video.is_deleted == filters['is_deleted'])
+    if filters.get('is_active') is not None:
+        conditions.append(Video.is_active == filters['is_active'])
+    if filters.get('created_from') is not None:
+        conditions.append(Video.created_date >= filters['created_from'])
+    if filters.get('created_to') is not None:
+        conditions.append(Video.created_date <= filters['created_to'])
+    return conditions
+
+
+def listing_query(sort: str = 'created_date', descending: bool = True, filters: dict = None, after: list = None):
+    """
+    Videos without keyword in sort order, every combination of filters and sort is served by one of the
+    ix_video_deleted_* indexes without sorting, see listing_query_plans
+    :param sort: created_date or modified_date
+    :param descending:
+    :param filters: see filter_conditions
+    :param after: sort key of last video of previous page
+    :return: query and its sort columns
+    """
+
+    columns = [SORT_COLUMNS[sort], Video.id]
+    directions = [descending] * 2
+    query = Video.query.filter(*filter_conditions(filters or {}))
+    if after:
+        # the bound on the first column keeps a single range scan, the OR alone may be planned as a union
+        query = query.filter(columns[0] <= after[0] if descending else columns[0] >= after[0],
+                             keyset_filter(columns, after, directions))
+    return query.order_by(*order_columns(columns, directions)), columns
+
+
+def listing_query_plans(now: int) -> list:
+    """
+    Plan every supported combination of listing filters, sort, order and cursor, MySQL and SQLite only.
+    A plan is ok if it is an index scan, with neither full table scan nor sort of all matching rows, sorting the
+    rows of a created date range the index seeks to is fine
+    :param now: timestamp the created date ranges and cursor are relative to
+    :return: list of dict: sort, descending, filters, cursor, index, details, is_ok, is_sorted
+    """
+
+    dialect = db.engine.dialect.name
+    # planner statistics, mysql and sqlite both understand it
+    db.session.execute('ANALYZE TABLE video' if dialect == 'mysql' else 'ANALYZE video')
+    db.session.commit()
+
+    ranges = [(None, None), (now - 86400 * 30, None), (None, now - 86400), (now - 86400 * 30, now - 86400)]
+    plans = []
+    for sort, descending, is_deleted, is_active, (created_from, created_to), with_cursor in itertools.product(
+            ['created_date', 'modified_date'], [True, False], [False, True], [None, True, False], ranges,
+            [False, True]):
+        filters = {'is_deleted': is_deleted, 'is_active': is_active, 'created_from': created_from,
+                   'created_to': created_to}
+        after = [now - 86400 * 7, 'ffffffff-ffff-ffff-ffff-ffffffffffff'] if with_cursor else None
+        query, _ = listing_query(sort, descending, filters, after)
+        statement = str(query.limit(20).statement.compile(dialect=db.engine.dialect,
+                                                           compile_kwargs={'literal_binds': True}))
+        if dialect == 'mysql':
+            plan = [dict(row._mapping) for row in db.session.execute('EXPLAIN ' + statement)]
+            index = plan[0]['key']
+            is_indexed = all(row['type'] != 'ALL' and row['key'] for row in plan)
+            is_sorted = any('filesort' in (row['Extra'] or '') for row in plan)
+            is_range = plan[0]['type'] == 'range' and 'created_date' in (index or '')
+            details = '; '.join(f"type={row['type']} key={row['key']} extra={row['Extra']}" for row in plan)
+        else:
+            plan = [row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + statement)]
+            details = '; '.join(plan)
+            found = re.search(r'USING (?:COVERING )?INDEX (\w+)', details)
+            index = found.group(1) if found else None
+            is_indexed = bool(found) and not any(detail.startswith('SCAN') and 'INDEX' not in detail
+                                                 for detail in plan)
+            is_sorted = 'TEMP B-TREE' in details
+            is_range = re.search(r'created_date[<>]', details) is not None
+
+        plans.append({'sort': sort, 'descending': descending, 'filters': filters, 'cursor': with_cursor,
+                      'index': index, 'details': details, 'is_ok': is_indexed and (not is_sorted or is_range),
+                      'is_sorted': is_sorted})
+    return plans
+
+
+class LikeSearchBackend(object):
+    """
+    Substring match with ILIKE '%keyword%', full table scan, no ranking
+    """
+
+    name = 'like'
+    ranked = False
+
+    def search(self, keyword: str, limit: int, after: list = None, descending: bool = True,
+               sort: str = 'created_date', filters: dict = None) -> list:
+        """
+        Search videos
+        :param keyword:
+        :param limit:
+        :param after: sort key of last video of previous page
+        :param descending: newest first
+        :param sort: created_date or modified_date
+        :param filters: see filter_conditions
+        :return: list of (video, sort key)
+        """
+
+        columns = [SORT_COLUMNS[sort], Video.id]
+        directions = [descending] * 2
+        query = Video.query.filter(Video.title.ilike(f'%{keyword}%'), *filter_conditions(filters or {}))
+        if after:
+            query = query.filter(keyset_filter(columns, after, directions))
+        videos = query.order_by(*order_columns(columns, directions)).limit(limit).all()
+        return [(video, [getattr(video, sort), video.id]) for video in videos]
+
+    def index_video(self, video: Video) -> None:
+        pass
+
+    def rebuild(self) -> int:
+        return 0
+
+
+class FullTextSearchBackend(object):
+    """
+    MySQL FULLTEXT index on video.title.
+    Every keyword token must prefix match a title word, results are ranked by natural language relevance.
+    The index is maintained by InnoDB on insert.
+    """
+
+    name = 'fulltext'
+    ranked = True
+
+    def search(self, keyword: str, limit: int, after: list = None, descending: bool = True,
+               sort: str = 'created_date', filters: dict = None) -> list:
+        terms = tokenize(keyword)
+        if not terms:
+            return []
+        condition = match(Video.title, against=' '.join(f'+{term}*' for term in terms)).in_boolean_mode()
+        relevance = match(Video.title, against=' '.join(terms)).in_natural_language_mode()
+
+        # most relevant first, then by sort column
+        columns = [relevance, SORT_COLUMNS[sort], Video.id]
+        directions = [True, descending, descending]
+        query = db.session.query(Video, relevance.label('score')).filter(condition, *filter_conditions(filters or {}))
+        if after:
+            query = query.filter(keyset_filter(columns, after, directions))
+        rows = query.order_by(*order_columns(columns, directions)).limit(limit).all()
+        return [(video, [score, getattr(video, sort), video.id]) for video, score in rows]
+
+    def index_video(self, video: Video) -> None:
+        pass
+
+    def rebuild(self) -> int:
+        return 0
+
+
+class InMemorySearchBackend(object):
+    """
+    Pure python inverted index of video titles ranked by BM25, used with SQLite.
+
+    Every keyword token must prefix match a title word. The index is loaded lazily and catches up with
+    rows inserted by other processes through the SQLite rowid, updates and deletes are picked up by rebuild.
+    """
+
+    name = 'memory'
+    ranked = True
+    K1 = 1.2
+    B = 0.75
+    SORT_FIELDS = {'created_date': 2, 'modified_date': 3}  # position in doc
+
+    def __init__(self):
+        self._postings = {}  # token -> {video_id: term frequency}
+        self._docs = {}  # video_id -> (number of tokens, set of tokens, created date, modified date, deleted, active)
+        self._total_length = 0
+        self._vocabulary = []  # sorted tokens, for prefix match
+        self._vocabulary_dirty = False
+        self._last_rowid = 0
+        self._lock = threading.RLock()
+
+    def search(self, keyword: str, limit: int, after: list = None, descending: bool = True,
+               sort: str = 'created_date', filters: dict = None) -> list:
+        terms = tokenize(keyword)
+        if not terms:
+            return []
+        sort_index = self.SORT_FIELDS[sort]
+        filters = filters or {}
+
+        with self._lock:
+            self.sync()
+            scores = None
+            for term in terms:
+                term_scores = self._score_term(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {_id: score + term_scores[_id] for _id, score in scores.items() if _id in term_scores}
+                if not scores:
+                    return []
+
+            docs = self._docs
+            sort_keys = [[score, docs[_id][sort_index], _id] for _id, score in scores.items()
+                         if self._matches(docs[_id], filters)]
+
+        # most relevant first, then by sort column. Only the page is sorted: O(matches * log(limit))
+        if descending:
+            if after:
+                sort_keys = [key for key in sort_keys if key < after]
+            page = heapq.nlargest(limit, sort_keys)
+        else:
+            def order(key):
+                return -key[0], key[1], key[2]
+            if after:
+                sort_keys = [key for key in sort_keys if order(key) > order(after)]
+            page = heapq.nsmallest(limit, sort_keys, key=order)
+
+        videos = {video.id: video for video in Video.query.filter(Video.id.in_([key[2] for key in page]))}
+        return [(videos[key[2]], key) for key in page if key[2] in videos]
+
+    def index_video(self, video: Video) -> None:
+        with self._lock:
+            self._add(video.id, video.title, video.created_date, video.modified_date, video.is_deleted,
+                      video.is_active)
+
+    def sync(self) -> int:
+        """
+        Index rows inserted since last sync
+        :return: number of indexed rows
+        """
+
+        with self._lock:
+            rows = db.session.execute(text('SELECT rowid, id, title, created_date, modified_date, is_deleted, '
+                                           'is_active FROM video WHERE rowid > :rowid ORDER BY rowid')
+                                      .columns(id=Video.id.type),
+                                      {'rowid': self._last_rowid}).fetchall()
+            for rowid, _id, title, created_date, modified_date, is_deleted, is_active in rows:
+                self._add(_id, title, created_date, modified_date, is_deleted, is_active)
+                self._last_rowid = rowid
+            return len(rows)
+
+    def rebuild(self) -> int:
+        """
+        Drop index and load all rows again
+        :return: number of indexed rows
+        """
+
+        with self._lock:
+            self._postings = {}
+            self._docs = {}
+            self._total_length = 0
+            self._vocabulary = []
+            self._last_rowid = 0
+            return self.sync()
+
+    @staticmethod
+    def _matches(doc: tuple, filters: dict) -> bool:
+        """
+        Same filters as filter_conditions, on an indexed doc
+        """
+
+        _, _, created_date, _, is_deleted, is_active = doc
+        return ((filters.get('is_deleted') is None or bool(is_deleted) == filters['is_deleted'])
+                and (filters.get('is_active') is None or bool(is_active) == filters['is_active'])
+                and (filters.get('created_from') is None or created_date >= filters['created_from'])
+                and (filters.get('created_to') is None or created_date <= filters['created_to']))
+
+    def _add(self, _id: str, title: str, created_date: int, modified_date: int, is_deleted: bool,
+             is_active: bool) -> None:
+        self._remove(_id)
+        tokens = tokenize(title)
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._vocabulary_dirty = True
+            postings[_id] = postings.get(_id, 0) + 1
+        self._docs[_id] = (len(tokens), set(tokens), created_date, modified_date or 0, is_deleted, is_active)
+        self._total_length += len(tokens)
+
+    def _remove(self, _id: str) -> None:
+        doc = self._docs.pop(_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc[0]
+        for token in doc[1]:
+            postings = self._postings[token]
+            del postings[_id]
+            if not postings:
+                del self._postings[token]
+                self._vocabulary_dirty = True
+
+    def _expand(self, term: str) -> list:
+        """
+        Tokens in index starting with term
+        """
+
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect.bisect_left(self._vocabulary, term)
+        end = bisect.bisect_left(self._vocabulary, term + '\uffff', start)
+        return self._vocabulary[start:end]
+
+    def _score_term(self, term: str) -> dict:
+        total_docs = len(self._docs)
+        avg_length = self._total_length / total_docs if total_docs else 0
+        scores = {}
+        for token in self._expand(term):
+            postings = self._postings[token]
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for _id, frequency in postings.items():
+                norm = self.K1 * (1 - self.B + self.B * self._docs[_id][0] / avg_length)
+                scores[_id] = scores.get(_id, 0) + idf * frequency * (self.K1 + 1) / (frequency + norm)
+        return scores
+
+
+SEARCH_BACKENDS = {
+    LikeSearchBackend.name: LikeSearchBackend,
+    FullTextSearchBackend.name: FullTextSearchBackend,
+    InMemorySearchBackend.name: InMemorySearchBackend,
+}
+
+
+class SearchEngine(object):
+    """
+    Search videos by title with the backend chosen by SEARCH_BACKEND
+    """
+
+    def __init__(self):
+        self.backend = LikeSearchBackend()
+
+    def init_app(self, app):
+        self.backend = SEARCH_BACKENDS[app.config['SEARCH_BACKEND']]()
+
+    def normalize(self, keyword: str) -> str:
+        """
+        Keywords with the same normalised form have the same results
+        """
+
+        if self.backend.ranked:
+            return ' '.join(tokenize(keyword))
+        return keyword.casefold()
+
+    def search(self, keyword: str, limit: int, cursor: str = None, descending: bool = True,
+               sort: str = 'created_date', filters: dict = None) -> tuple:
+        """
+        Search a page of videos, keyset paginated so every page costs the same
+        :param keyword: empty keyword returns all videos
+        :param limit: page size
+        :param cursor: next cursor of previous page
+        :param descending: newest first
+        :param sort: created_date or modified_date, after relevance when there is a keyword
+        :param filters: see filter_conditions
+        :return: (list videos, next cursor or None), raise ValueError if cursor is invalid
+        """
+
+        after = decode_cursor(cursor) if cursor else None
+        key_size = 3 if keyword and self.backend.ranked else 2
+        if after and len(after) != key_size:
+            raise ValueError('Invalid cursor')
+
+        # fetch one more row to know if there is a next page
+        if keyword:
+            rows = self.backend.search(keyword, limit + 1, after, descending, sort, filters)
+        else:
+            query, _ = listing_query(sort, descending, filters, after)
+            rows = [(video, [getattr(video, sort), video.id]) for video in query.limit(limit + 1).all()]
+
+        next_cursor = encode_cursor(rows[limit - 1][1]) if len(rows) > limit else None
+        return [video for video, _ in rows[:limit]], next_cursor
+
+    def index_video(self, video: Video) -> None:
+        self.backend.index_video(video)
+
+    def rebuild(self) -> int:
+        return self.backend.rebuild()
+
+
+search_engine = SearchEngine()
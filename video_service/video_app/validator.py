@@ -1,4 +1,5 @@
-from marshmallow import Schema, fields, validate
+from marshmallow import EXCLUDE, Schema, fields, validate
+from video_app.validation import CompiledValidator, TRIM_ALL
 
 
 class CreateVideoSchema(Schema):
@@ -20,6 +21,38 @@ class CreateVideoSchema(Schema):
     thumbnail_url = fields.String(required=False, validate=[validate.Length(min=1, max=1000)])
 
 
+class SearchVideoSchema(Schema):
+    """
+    Validate params of search video api
+    :param
+        keyword: string, optional
+        limit: integer, optional
+        cursor: string, optional
+        order: string, optional, asc or desc
+        sort: string, optional, created_date or modified_date
+        is_deleted: boolean, optional
+        is_active: boolean, optional
+        created_from: integer, optional, timestamp
+        created_to: integer, optional, timestamp
+    Ex:
+        ?keyword=music&limit=20&order=desc&sort=created_date&is_active=true&cursor=WzE2NTk0MjM0MDAsImFiYyJd
+    """
+
+    class Meta:
+        # public read api, cache busters and tracking params (_=..., utm_source=...) are ignored
+        unknown = EXCLUDE
+
+    keyword = fields.String(required=False, validate=[validate.Length(max=500)])
+    limit = fields.Integer(required=False, validate=[validate.Range(min=1)])
+    cursor = fields.String(required=False, validate=[validate.Length(min=1, max=1000)])
+    order = fields.String(required=False, validate=[validate.OneOf(['asc', 'desc'])])
+    sort = fields.String(required=False, validate=[validate.OneOf(['created_date', 'modified_date'])])
+    is_deleted = fields.Boolean(required=False)
+    is_active = fields.Boolean(required=False)
+    created_from = fields.Integer(required=False, validate=[validate.Range(min=0)])
+    created_to = fields.Integer(required=False, validate=[validate.Range(min=0)])
+
+
 class VideoSchema(Schema):
     """
     Video Schema
@@ -33,3 +66,36 @@ class VideoSchema(Schema):
     modified_date = fields.Number()
     is_deleted = fields.Boolean()
     is_active = fields.Boolean()
+
+
+# compiled once at import, apis validate with these instead of a schema instance per request
+create_video_validator = CompiledValidator(CreateVideoSchema, trim=TRIM_ALL)
+search_video_validator = CompiledValidator(SearchVideoSchema)
+
+
+def parse_bool(value: str) -> bool:
+    """
+    Boolean of a query param already validated by fields.Boolean
+    """
+    return value in fields.Boolean.truthy
+
+
+def dump_video(video) -> dict:
+    """
+    Same output as VideoSchema().dump(video), without marshmallow overhead, used on listing api
+    """
+
+    created_date = video.created_date
+    modified_date = video.modified_date
+    is_deleted = video.is_deleted
+    is_active = video.is_active
+    return {
+        'id': video.id,
+        'title': video.title,
+        'url': video.url,
+        'thumbnail_url': video.thumbnail_url,
+        'created_date': None if created_date is None else float(created_date),
+        'modified_date': None if modified_date is None else float(modified_date),
+        'is_deleted': None if is_deleted is None else bool(is_deleted),
+        'is_active': None if is_active is None else bool(is_active),
+    }
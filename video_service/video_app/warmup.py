@@ -0,0 +1,19 @@
+from video_app.extensions import db
+from video_app.models import Video
+from video_app.search import search_engine
+
+
+def warm_up(app):
+    """
+    Do the one-off work of first requests before serving: database dialect setup, statement compilation,
+    in memory search index. Run in gunicorn master, workers forked from it start warm.
+    Pooled connections are closed at the end so workers open their own.
+    :param app:
+    :return:
+    """
+
+    with app.test_request_context():
+        with db.replica():
+            Video.get_newest()
+            search_engine.search('warmup', 1)
+    db.dispose(app)